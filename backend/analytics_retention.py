@@ -0,0 +1,228 @@
+"""Retention and daily downsampling of raw analytics events.
+
+``AnalyticsRetention`` rolls every completed UTC day of raw events in
+``analytics`` up into ``analytics_daily``: one document per product, event
+type and day with the event count. ``analytics_rollup_state`` records the
+last rolled-up day (the watermark). Reports read the rollups up to the
+watermark plus the raw events after it, so they only ever scan about a day of
+raw events and keep working after the raw events have expired.
+
+Raw events are deleted by the same job once they are
+``ANALYTICS_RETENTION_DAYS`` days old (0 keeps them forever), but never past
+the watermark: an event is only deleted after its day is in the rollups. With
+``ANALYTICS_ROLLUP_ENABLED=false`` nothing rolls up, so nothing expires
+either. A TTL index would delete events whether or not they were rolled up,
+so the one older versions created is dropped on start, dry run or not.
+
+With ``ANALYTICS_RETENTION_DRY_RUN`` the job only reports what it would roll
+up and what it would delete; it writes nothing.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime, time, timedelta, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DAILY_COLLECTION = 'analytics_daily'
+STATE_COLLECTION = 'analytics_rollup_state'
+TTL_INDEX_NAME = 'timestamp_ttl'
+
+# Sampled views (ANALYTICS_VIEW_SAMPLE_RATE) stand in for 1/rate events each
+EVENT_WEIGHT = {'$ifNull': ['$weight', 1]}
+
+
+def day_start(day):
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+class AnalyticsRetention:
+    def __init__(self, retention_days=90, interval_s=3600.0, dry_run=False, enabled=True):
+        self.retention_days = retention_days
+        self.interval_s = interval_s
+        self.dry_run = dry_run
+        self.enabled = enabled
+        self._task = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            retention_days=int(environ.get('ANALYTICS_RETENTION_DAYS', 90)),
+            interval_s=float(environ.get('ANALYTICS_ROLLUP_INTERVAL_S', 3600)),
+            dry_run=environ.get('ANALYTICS_RETENTION_DRY_RUN', 'false').lower() == 'true',
+            enabled=environ.get('ANALYTICS_ROLLUP_ENABLED', 'true').lower() == 'true',
+        )
+
+    async def start(self, db):
+        await db[DAILY_COLLECTION].create_index(
+            [('product_id', 1), ('event_type', 1), ('day', 1)], unique=True
+        )
+        # Dropping it only stops deletions, so this happens in dry runs too
+        await self.drop_ttl_index(db)
+        await db.analytics.create_index('timestamp')
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def drop_ttl_index(self, db):
+        try:
+            await db.analytics.drop_index(TTL_INDEX_NAME)
+        except OperationFailure:
+            # Already gone (IndexNotFound)
+            pass
+
+    async def _run(self, db):
+        while True:
+            try:
+                report = await self.run_once(db)
+                if report['rolled_up_days']:
+                    logger.info(
+                        f"Analytics rollup {'(dry run) ' if report['dry_run'] else ''}"
+                        f"{len(report['rolled_up_days'])} day(s), {report['rolled_up_events']} event(s) "
+                        f"into {report['daily_rows']} daily row(s)"
+                    )
+                if report.get('expired_events'):
+                    logger.info(
+                        f"Analytics retention {'(dry run) ' if report['dry_run'] else ''}"
+                        f"expired {report['expired_events']} raw event(s) before {report['expires_before']}"
+                    )
+            except Exception:
+                logger.exception("Analytics rollup failed")
+            await asyncio.sleep(self.interval_s)
+
+    async def watermark(self, db):
+        """Last day (``date``) that is fully rolled up, or None"""
+        state = await db[STATE_COLLECTION].find_one({'_id': 'daily'})
+        if not state or not state.get('rolled_through'):
+            return None
+        return datetime.fromisoformat(state['rolled_through']).date()
+
+    async def run_once(self, db, dry_run=None, now=None):
+        """Roll up every completed day after the watermark; returns a report of what was (or would be) done"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        now = now or datetime.now(timezone.utc)
+        today = now.date()
+
+        rolled_through = await self.watermark(db)
+        if rolled_through is None:
+            first = await db.analytics.find({}, {'_id': 0, 'timestamp': 1}).sort('timestamp', 1).limit(1).to_list(1)
+            first_day = first[0]['timestamp'].date() if first and isinstance(first[0]['timestamp'], datetime) else today
+        else:
+            first_day = rolled_through + timedelta(days=1)
+
+        report = {'dry_run': dry_run, 'rolled_up_days': [], 'rolled_up_events': 0, 'daily_rows': 0}
+        last_day = rolled_through
+        day = first_day
+        while day < today:
+            rows = await db.analytics.aggregate([
+                {'$match': {'timestamp': {'$gte': day_start(day), '$lt': day_start(day + timedelta(days=1))}}},
+                {'$group': {
+                    '_id': {'product_id': '$product_id', 'event_type': '$event_type'},
+                    'count': {'$sum': EVENT_WEIGHT}
+                }}
+            ]).to_list(None)
+            if rows and not dry_run:
+                # $set, not $inc: re-running a day after a crash rewrites the same totals
+                await db[DAILY_COLLECTION].bulk_write([
+                    UpdateOne(
+                        {'product_id': row['_id']['product_id'], 'event_type': row['_id']['event_type'],
+                         'day': day.isoformat()},
+                        {'$set': {'count': row['count']}},
+                        upsert=True
+                    )
+                    for row in rows
+                ], ordered=False)
+            if not dry_run:
+                await db[STATE_COLLECTION].update_one(
+                    {'_id': 'daily'}, {'$set': {'rolled_through': day.isoformat()}}, upsert=True
+                )
+            report['rolled_up_days'].append(day.isoformat())
+            report['rolled_up_events'] += int(round(sum(row['count'] for row in rows)))
+            report['daily_rows'] += len(rows)
+            last_day = day
+            day += timedelta(days=1)
+
+        report['watermark'] = last_day.isoformat() if last_day else None
+        if self.retention_days > 0:
+            report['retention_days'] = self.retention_days
+            report['expires_before'] = None
+            report['expired_events'] = 0
+            if last_day is not None:
+                # Only days that are in the rollups may lose their raw events
+                expires_before = min(now - timedelta(days=self.retention_days), day_start(last_day + timedelta(days=1)))
+                expired = {'timestamp': {'$lt': expires_before}}
+                report['expires_before'] = expires_before.isoformat()
+                if dry_run:
+                    report['expired_events'] = await db.analytics.count_documents(expired)
+                else:
+                    report['expired_events'] = (await db.analytics.delete_many(expired)).deleted_count
+        return report
+
+    async def event_counts(self, db, event_type=None, first_day=None):
+        """Event totals per ``(product_id, event_type)``: daily rollups plus raw events after the watermark
+
+        With ``first_day`` (a ``date``) only events from that UTC day on are counted.
+        """
+        rolled_through = await self.watermark(db)
+        raw_match = {}
+        daily_match = {}
+        if event_type:
+            raw_match['event_type'] = daily_match['event_type'] = event_type
+        raw_from = first_day
+
+        counts = {}
+        if rolled_through is not None:
+            raw_from = max(rolled_through + timedelta(days=1), first_day or date.min)
+            daily_match['day'] = {'$lte': rolled_through.isoformat()}
+            if first_day is not None:
+                daily_match['day']['$gte'] = first_day.isoformat()
+            daily = await db[DAILY_COLLECTION].aggregate([
+                {'$match': daily_match},
+                {'$group': {'_id': {'product_id': '$product_id', 'event_type': '$event_type'},
+                            'count': {'$sum': '$count'}}}
+            ]).to_list(None)
+            for row in daily:
+                key = (row['_id']['product_id'], row['_id']['event_type'])
+                counts[key] = counts.get(key, 0) + row['count']
+
+        if raw_from is not None:
+            raw_match['timestamp'] = {'$gte': day_start(raw_from)}
+        pipeline = [{'$match': raw_match}] if raw_match else []
+        raw = await db.analytics.aggregate(pipeline + [
+            {'$group': {'_id': {'product_id': '$product_id', 'event_type': '$event_type'},
+                        'count': {'$sum': EVENT_WEIGHT}}}
+        ]).to_list(None)
+        for row in raw:
+            key = (row['_id']['product_id'], row['_id']['event_type'])
+            counts[key] = counts.get(key, 0) + row['count']
+        return {key: int(round(count)) for key, count in counts.items()}
+
+    async def discount(self, db, match):
+        """Take raw events matching ``match`` out of already rolled-up days before they are deleted"""
+        rolled_through = await self.watermark(db)
+        if rolled_through is None:
+            return
+        events = await db.analytics.find(
+            {'$and': [match, {'timestamp': {'$lt': day_start(rolled_through + timedelta(days=1))}}]},
+            {'_id': 0, 'product_id': 1, 'event_type': 1, 'timestamp': 1, 'weight': 1}
+        ).to_list(None)
+        totals = {}
+        for event in events:
+            key = (event['product_id'], event['event_type'], event['timestamp'].date().isoformat())
+            totals[key] = totals.get(key, 0) + event.get('weight', 1)
+        if totals:
+            await db[DAILY_COLLECTION].bulk_write([
+                UpdateOne({'product_id': product_id, 'event_type': event_type, 'day': day}, {'$inc': {'count': -count}})
+                for (product_id, event_type, day), count in totals.items()
+            ], ordered=False)
+
+    async def reset(self, db):
+        await db[DAILY_COLLECTION].delete_many({})
+        await db[STATE_COLLECTION].delete_many({})
@@ -0,0 +1,234 @@
+"""Precompressed catalog snapshots.
+
+The catalog (``/api/products`` and ``/api/categories``) is read on every guest
+page view but only changes when an admin edits it. ``CatalogSnapshots``
+keeps, per query variant, the encoded JSON body together with its gzip and
+brotli compressions, and serves the best one the client accepts without any
+per-request serialization or compression work.
+
+Every product, category or settings write runs inside ``write()``, which
+reserves the next catalog version in the ``catalog_meta`` document before the
+write and publishes it once the write is done. The write stamps its documents
+with the reserved version; ``current_version`` only reports versions whose
+writes, and every earlier one, have been published, so a delta sync can never
+move past a write that is still in flight. Snapshots are tied to the publish
+counter, so a snapshot built while a write was running is rebuilt as soon as
+that write is published. A reservation left behind by a crashed worker stops
+holding the version back after ``CATALOG_WRITE_TIMEOUT_S``.
+
+Workers re-read ``catalog_meta`` at most every ``CATALOG_VERSION_TTL_S``
+seconds, so edits made through another worker show up within that window; the
+writing worker sees them immediately. ``brotli`` is optional: without it only
+gzip is offered.
+"""
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+CATALOG_META_ID = 'catalog'
+
+
+def encode_json(content):
+    """Encode exactly like FastAPI's JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def parse_accept_encoding(header):
+    """Map of accepted codings to their q-value"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class Snapshot:
+    def __init__(self, generation, body, gzip_level, brotli_quality):
+        self.generation = generation
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=gzip_level, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=brotli_quality)
+        # Each encoding is a distinct representation and gets its own entity tag
+        digest = hashlib.sha1(body).hexdigest()
+        self.etags = {coding: f'"{digest}"' if coding == 'identity' else f'"{digest}-{coding}"'
+                      for coding in self.bodies}
+
+    def choose_encoding(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding or '')
+        wildcard = accepted.get('*', 0.0)
+        best, best_q = 'identity', 0.0
+        # Preference order on equal q-values: smallest body first
+        for coding in ('br', 'gzip'):
+            if coding not in self.bodies:
+                continue
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+
+class CatalogSnapshots:
+    def __init__(self, version_ttl_s=1.0, max_variants=64, gzip_level=9, brotli_quality=11, enabled=True,
+                 write_timeout_s=60.0):
+        self.version_ttl_s = version_ttl_s
+        self.max_variants = max_variants
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+        self.write_timeout_s = write_timeout_s
+        self._version = None
+        self._generation = None
+        self._version_checked_at = 0.0
+        self._snapshots = OrderedDict()
+        self._locks = {}
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            version_ttl_s=float(environ.get('CATALOG_VERSION_TTL_S', 1.0)),
+            max_variants=int(environ.get('CATALOG_SNAPSHOT_VARIANTS', 64)),
+            gzip_level=int(environ.get('CATALOG_GZIP_LEVEL', 9)),
+            brotli_quality=int(environ.get('CATALOG_BROTLI_QUALITY', 11)),
+            enabled=environ.get('CATALOG_SNAPSHOTS', 'true').lower() == 'true',
+            write_timeout_s=float(environ.get('CATALOG_WRITE_TIMEOUT_S', 60)),
+        )
+
+    def _load_meta(self, meta):
+        """Take the published version and publish counter from a ``catalog_meta`` document"""
+        meta = meta or {}
+        stale = datetime.now(timezone.utc) - timedelta(seconds=self.write_timeout_s)
+        in_flight = [p['version'] for p in meta.get('pending', [])
+                     if p['at'].replace(tzinfo=timezone.utc) >= stale]
+        self._version = min(in_flight) - 1 if in_flight else meta.get('version', 0)
+        self._generation = meta.get('generation', 0)
+        self._version_checked_at = time.monotonic()
+        return len(in_flight) < len(meta.get('pending', []))
+
+    async def _refresh(self, db):
+        if self._version is None or time.monotonic() - self._version_checked_at >= self.version_ttl_s:
+            if self._load_meta(await db.catalog_meta.find_one({'_id': CATALOG_META_ID})):
+                stale = datetime.now(timezone.utc) - timedelta(seconds=self.write_timeout_s)
+                await db.catalog_meta.update_one(
+                    {'_id': CATALOG_META_ID}, {'$pull': {'pending': {'at': {'$lt': stale}}}}
+                )
+
+    async def current_version(self, db):
+        """Highest version whose write and every earlier one have finished"""
+        await self._refresh(db)
+        return self._version
+
+    async def reserve(self, db):
+        """Take the next catalog version for a write without publishing it"""
+        while True:
+            meta = await db.catalog_meta.find_one({'_id': CATALOG_META_ID}, {'version': 1})
+            pending = {'version': (meta['version'] if meta else 0) + 1, 'at': datetime.now(timezone.utc)}
+            if meta is None:
+                try:
+                    await db.catalog_meta.insert_one(
+                        {'_id': CATALOG_META_ID, 'version': 1, 'generation': 0, 'pending': [pending]}
+                    )
+                    return 1
+                except DuplicateKeyError:
+                    continue
+            # Compare-and-set: the version and its pending entry change in one atomic update
+            result = await db.catalog_meta.update_one(
+                {'_id': CATALOG_META_ID, 'version': meta['version']},
+                {'$inc': {'version': 1}, '$push': {'pending': pending}}
+            )
+            if result.modified_count:
+                return pending['version']
+
+    async def publish(self, db, version):
+        """Mark the write stamped ``version`` as finished and drop the snapshots it made stale"""
+        meta = await db.catalog_meta.find_one_and_update(
+            {'_id': CATALOG_META_ID},
+            {'$pull': {'pending': {'version': version}}, '$inc': {'generation': 1},
+             '$set': {'updated_at': datetime.now(timezone.utc).isoformat()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._load_meta(meta)
+        self._snapshots.clear()
+
+    @contextlib.asynccontextmanager
+    async def write(self, db):
+        """Reserve a version for the catalog write in the ``async with`` block, publish it after"""
+        version = await self.reserve(db)
+        try:
+            yield version
+        finally:
+            await self.publish(db, version)
+
+    async def get(self, db, key, build):
+        """Snapshot for ``key`` as of the last published write, built with ``build()`` if stale"""
+        await self._refresh(db)
+        generation = self._generation
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and snapshot.generation == generation:
+            self._snapshots.move_to_end(key)
+            return snapshot
+
+        # One build per variant and version, however many requests are waiting
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                snapshot = self._snapshots.get(key)
+                if snapshot is not None and snapshot.generation == generation:
+                    return snapshot
+                body = encode_json(await build())
+                # Compressing large catalogs (inline images) takes a while; keep it off the loop
+                snapshot = await asyncio.to_thread(Snapshot, generation, body, self.gzip_level, self.brotli_quality)
+                self._snapshots[key] = snapshot
+                self._snapshots.move_to_end(key)
+                while len(self._snapshots) > self.max_variants:
+                    self._snapshots.popitem(last=False)
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+        return snapshot
+
+    def respond(self, snapshot, request):
+        encoding = snapshot.choose_encoding(request.headers.get('accept-encoding'))
+        etag = snapshot.etags[encoding]
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+        if etag in request.headers.get('if-none-match', ''):
+            return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=snapshot.bodies[encoding], media_type='application/json', headers=headers)
+
+    async def serve(self, db, request, key, build):
+        if not self.enabled:
+            return await build()
+        return self.respond(await self.get(db, key, build), request)
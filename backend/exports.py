@@ -0,0 +1,117 @@
+"""Streaming CSV and NDJSON exports of orders and analytics events.
+
+Rows are read from MongoDB cursors in batches of ``EXPORT_BATCH_SIZE`` and
+written to the response whenever about ``EXPORT_CHUNK_BYTES`` of output has
+built up, so an export holds one cursor batch and one chunk in memory however
+many rows it covers. ``stream_export`` is the encoder; the endpoints in
+server.py build the cursors.
+
+CSV cells that a spreadsheet would read as a formula (``=``, ``+``, ``-``,
+``@``, other than plain phone numbers) are prefixed with ``'``. NDJSON rows
+are the stored documents as they are, so they are the format to use for
+re-importing.
+"""
+import csv
+import json
+import os
+import re
+from datetime import datetime
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', 64 * 1024))
+
+MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+ORDER_COLUMNS = [
+    'id', 'created_at', 'updated_at', 'status', 'guest_name', 'room_number', 'phone',
+    'delivery_preference', 'notes', 'items', 'total',
+]
+ANALYTICS_COLUMNS = ['id', 'timestamp', 'product_id', 'event_type', 'weight']
+
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Phone numbers and signed numbers start with + or - but cannot call anything
+PLAIN_NUMBER = re.compile(r'[+-]?[\d\s().-]+')
+
+
+def order_row(order):
+    """Flat CSV values for an order; items become ``2x Name; 1x Other``"""
+    row = dict(order)
+    row['items'] = '; '.join(f"{item.get('quantity', 1)}x {item.get('name', '')}" for item in order.get('items', []))
+    return row
+
+
+def analytics_row(event):
+    row = dict(event)
+    row.setdefault('weight', 1)
+    return row
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not PLAIN_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def merge_sorted(first, second, key):
+    """Merge two async iterators that are each sorted by ``key``"""
+    a = await anext(first, None)
+    b = await anext(second, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and key(a) <= key(b)):
+            yield a
+            a = await anext(first, None)
+        else:
+            yield b
+            b = await anext(second, None)
+
+
+class _Chunk:
+    """File-like target that collects output until it is taken as one encoded chunk"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def take(self):
+        data = ''.join(self.parts).encode('utf-8')
+        self.parts = []
+        self.size = 0
+        return data
+
+
+async def stream_export(documents, fmt, columns, to_row=dict):
+    """Encode ``documents`` (an async iterator) as CSV or NDJSON, yielding bytes chunk by chunk"""
+    chunk = _Chunk()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(chunk, lineterminator='\n')
+        writer.writerow(columns)
+
+    async for doc in documents:
+        if writer is not None:
+            row = to_row(doc)
+            writer.writerow([_csv_value(row.get(column)) for column in columns])
+        else:
+            chunk.write(json.dumps(doc, default=_json_default, ensure_ascii=False) + '\n')
+        if chunk.size >= EXPORT_CHUNK_BYTES:
+            yield chunk.take()
+
+    if chunk.size:
+        yield chunk.take()
@@ -0,0 +1,120 @@
+"""Idempotency keys for retried writes.
+
+A client sends ``Idempotency-Key: <unique string>`` with a write such as
+POST /api/orders and reuses it for every retry of that same write. The first
+request claims the key in ``idempotency_keys`` (unique on route + key) and,
+once it succeeds, stores its response there. A retry finds the stored
+response in one indexed lookup and gets it replayed without any new writes.
+
+A duplicate that arrives while the first request is still running waits up to
+``IDEMPOTENCY_WAIT_S`` for its response, then gets 409 and should retry. A
+request that fails releases its key, so the client can try again; a claim
+left behind by a worker that died is taken over after ``IDEMPOTENCY_LOCK_S``.
+Reusing a key with a different request body is rejected with 422.
+
+Keys expire ``IDEMPOTENCY_TTL_HOURS`` after they were first used (TTL index
+on ``created_at``).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+KEYS_COLLECTION = 'idempotency_keys'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(body):
+    """Stable hash of a JSON-compatible request body"""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_hours=24.0, lock_s=30.0, wait_s=5.0, poll_s=0.1):
+        self.ttl_hours = ttl_hours
+        self.lock_s = lock_s
+        self.wait_s = wait_s
+        self.poll_s = poll_s
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            ttl_hours=float(environ.get('IDEMPOTENCY_TTL_HOURS', 24)),
+            lock_s=float(environ.get('IDEMPOTENCY_LOCK_S', 30)),
+            wait_s=float(environ.get('IDEMPOTENCY_WAIT_S', 5)),
+        )
+
+    async def ensure_indexes(self, db):
+        await db[KEYS_COLLECTION].create_index([('route', 1), ('key', 1)], unique=True)
+        await db[KEYS_COLLECTION].create_index('created_at', expireAfterSeconds=int(self.ttl_hours * 3600))
+
+    async def begin(self, db, route, key, body):
+        """Claim ``key`` for a new request.
+
+        Returns ``(claim, None)`` when the caller should run the request and then
+        call ``complete`` or ``release`` with ``claim``, or ``(None, response)``
+        with the stored ``{'status_code', 'body'}`` of the original request.
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+        query = {'route': route, 'key': key}
+        request_hash = fingerprint(body)
+        collection = db[KEYS_COLLECTION]
+        deadline = asyncio.get_running_loop().time() + self.wait_s
+
+        while True:
+            stored = await collection.find_one(query, {'_id': 0})
+            if stored is None:
+                now = datetime.now(timezone.utc)
+                claim = {**query, 'owner': str(uuid.uuid4())}
+                try:
+                    await collection.insert_one({
+                        **claim, 'fingerprint': request_hash, 'state': 'pending',
+                        'created_at': now, 'locked_until': now + timedelta(seconds=self.lock_s),
+                    })
+                    return claim, None
+                except DuplicateKeyError:
+                    # A concurrent duplicate claimed it first
+                    continue
+
+            if stored['fingerprint'] != request_hash:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            if stored['state'] == 'completed':
+                return None, stored['response']
+
+            now = datetime.now(timezone.utc)
+            if stored['locked_until'].replace(tzinfo=timezone.utc) < now:
+                # The original request died without completing or releasing the key
+                claim = {**query, 'owner': str(uuid.uuid4())}
+                result = await collection.update_one(
+                    {**query, 'state': 'pending', 'owner': stored['owner']},
+                    {'$set': {'owner': claim['owner'], 'locked_until': now + timedelta(seconds=self.lock_s)}}
+                )
+                if result.modified_count:
+                    return claim, None
+                continue
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still being processed",
+                    headers={'Retry-After': '1'}
+                )
+            await asyncio.sleep(self.poll_s)
+
+    async def complete(self, db, claim, status_code, body):
+        """Store the response of a claimed request for replay"""
+        await db[KEYS_COLLECTION].update_one(
+            claim,
+            {'$set': {'state': 'completed', 'response': {'status_code': status_code, 'body': body}},
+             '$unset': {'locked_until': ''}}
+        )
+
+    async def release(self, db, claim):
+        """Forget a claim whose request failed, so a retry runs it again"""
+        await db[KEYS_COLLECTION].delete_one({**claim, 'state': 'pending'})
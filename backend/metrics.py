@@ -0,0 +1,209 @@
+"""Prometheus instrumentation for the Teruza API.
+
+* ``PrometheusMiddleware`` records request duration, in-flight requests and
+  response size per route template (``/api/products/{product_id}``), so path
+  parameters never explode label cardinality.
+* ``record_mongo_command`` is a storage command observer (see ``storage``).
+  It records MongoDB command counts and durations per collection and
+  command name.
+* ``MongoPoolMetricsListener`` is a pymongo connection pool listener. It
+  tracks open, checked-out and waiting connections per server, connection
+  churn, checkout failures and how long requests wait for a connection.
+* ``HTTP_REQUESTS_REJECTED`` and ``EVENT_LOOP_LAG`` are fed by the rate
+  limiter and load shedder (see ``rate_limit``).
+* ``metrics_response`` renders the registry for the ``/metrics`` endpoint.
+  Set ``PROMETHEUS_MULTIPROC_DIR`` when running several uvicorn workers so
+  every worker's samples are aggregated.
+"""
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+from pymongo.common import MAX_POOL_SIZE
+from starlette.responses import Response
+
+from request_context import UNMATCHED_ROUTE, route_for_path
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request duration by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'HTTP requests currently being served',
+    ['method', 'route'], multiprocess_mode='livesum',
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'HTTP response body size by route',
+    ['method', 'route'], buckets=SIZE_BUCKETS,
+)
+HTTP_REQUESTS_REJECTED = Counter(
+    'http_requests_rejected_total', 'Requests refused by rate limiting or load shedding',
+    ['route', 'reason'],
+)
+EVENT_LOOP_LAG = Gauge(
+    'event_loop_lag_seconds', 'How far the event loop is running behind schedule',
+    multiprocess_mode='max',
+)
+EVENT_LOOP_STALLS = Counter(
+    'event_loop_stalls_total', 'Times the event loop was blocked longer than LOOP_STALL_THRESHOLD_MS',
+    ['route'],
+)
+MONGO_COMMANDS = Counter(
+    'mongodb_commands_total', 'MongoDB commands by collection, command and outcome',
+    ['collection', 'command', 'outcome'],
+)
+MONGO_COMMAND_DURATION = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command duration by collection and command',
+    ['collection', 'command'], buckets=LATENCY_BUCKETS,
+)
+MONGO_POOL_MAX_SIZE = Gauge(
+    'mongodb_pool_max_size', 'Configured maximum connections per server',
+    multiprocess_mode='max',
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    'mongodb_pool_connections', 'Open connections in the pool',
+    ['address'], multiprocess_mode='livesum',
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    'mongodb_pool_checked_out_connections', 'Connections currently checked out',
+    ['address'], multiprocess_mode='livesum',
+)
+MONGO_POOL_WAITING = Gauge(
+    'mongodb_pool_wait_queue_size', 'Operations waiting for a connection',
+    ['address'], multiprocess_mode='livesum',
+)
+MONGO_POOL_CREATED = Counter(
+    'mongodb_pool_connections_created_total', 'Connections opened', ['address'],
+)
+MONGO_POOL_CLOSED = Counter(
+    'mongodb_pool_connections_closed_total', 'Connections closed by reason', ['address', 'reason'],
+)
+MONGO_POOL_CHECKOUT_FAILED = Counter(
+    'mongodb_pool_checkout_failures_total', 'Failed connection checkouts by reason', ['address', 'reason'],
+)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    'mongodb_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+    ['address'], buckets=LATENCY_BUCKETS,
+)
+
+
+class PrometheusMiddleware:
+    def __init__(self, app, excluded_paths=('/metrics',)):
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        route = scope.get('state', {}).get('route_template')
+        if route is None:
+            route = route_for_path(scope['app'], scope) if 'app' in scope else UNMATCHED_ROUTE
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            elif message['type'] == 'http.response.body':
+                response_size += len(message.get('body', b''))
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_progress.dec()
+            HTTP_REQUEST_DURATION.labels(method, route, str(status_code)).observe(elapsed)
+            HTTP_RESPONSE_SIZE.labels(method, route).observe(response_size)
+
+
+def record_mongo_command(collection, command_name, duration_s, succeeded):
+    """Storage command observer feeding the MongoDB metrics"""
+    MONGO_COMMANDS.labels(collection, command_name, 'success' if succeeded else 'failure').inc()
+    MONGO_COMMAND_DURATION.labels(collection, command_name).observe(duration_s)
+
+
+def _address(event):
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class MongoPoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection pool health; a checkout starts and ends on the same thread"""
+
+    def __init__(self):
+        self._checkout = threading.local()
+
+    def pool_created(self, event):
+        MONGO_POOL_MAX_SIZE.set(event.options.get('maxPoolSize', MAX_POOL_SIZE))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CREATED.labels(_address(event)).inc()
+        MONGO_POOL_CONNECTIONS.labels(_address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CLOSED.labels(_address(event), event.reason).inc()
+        MONGO_POOL_CONNECTIONS.labels(_address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        self._checkout.started = time.perf_counter()
+        MONGO_POOL_WAITING.labels(_address(event)).inc()
+
+    def _end_wait(self, event):
+        MONGO_POOL_WAITING.labels(_address(event)).dec()
+        started = getattr(self._checkout, 'started', None)
+        self._checkout.started = None
+        return None if started is None else time.perf_counter() - started
+
+    def connection_check_out_failed(self, event):
+        self._end_wait(event)
+        MONGO_POOL_CHECKOUT_FAILED.labels(_address(event), event.reason).inc()
+
+    def connection_checked_out(self, event):
+        waited = self._end_wait(event)
+        if waited is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels(_address(event)).observe(waited)
+        MONGO_POOL_CHECKED_OUT.labels(_address(event)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(_address(event)).dec()
+
+
+def metrics_response():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,249 @@
+"""Move old finished orders out of the hot ``orders`` collection.
+
+``OrderArchiver`` periodically moves completed and cancelled orders created
+more than ``ORDER_ARCHIVE_AFTER_DAYS`` days ago into ``orders_archive``, in
+batches of ``ORDER_ARCHIVE_BATCH``. Each batch is copied (idempotent upserts
+by order id) before it is deleted from ``orders``, and an order is only
+deleted if it has not been modified since it was copied, so a crash or a
+concurrent status change never loses an order.
+
+Only one worker archives at a time: a pass first takes a lease in the
+``order_archive_state`` collection and stops as soon as renewing it fails.
+Per-status counts and revenue of everything archived are kept in that
+collection as well, so summaries do not need to scan the archive.
+
+The totals count each order exactly once. An archive copy starts out
+``copied``. The orders an archiver itself deleted from ``orders`` are
+claimed into a counting batch (``copied`` -> ``counting``). The batch is added
+to the totals in one update that records the batch id, so applying it again
+changes nothing. Only then are its orders marked ``counted``. Each pass first
+finishes what a crashed pass left behind: counting batches, and copies whose
+order is gone from ``orders`` but was never counted. Copies made before
+``archive_state`` existed were counted when they were archived. Deleting a
+hot order also drops an uncounted copy of it, so an order deleted while it is
+being archived does not come back from the archive.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = 'orders_archive'
+STATE_COLLECTION = 'order_archive_state'
+FINAL_STATUSES = ('completed', 'cancelled')
+# Recently applied counting batches remembered in the totals document
+APPLIED_BATCHES_KEPT = 100
+# Bookkeeping fields of archive copies, hidden from API responses and exports
+ARCHIVE_PROJECTION = {'_id': 0, 'archive_state': 0, 'archive_batch': 0}
+
+
+async def archived_totals(db):
+    """``{status: {'count': n, 'revenue': total}}`` for all archived orders"""
+    stats = await db[STATE_COLLECTION].find_one({'_id': 'totals'}, {'_id': 0})
+    return (stats or {}).get('by_status', {})
+
+
+async def adjust_archived_totals(db, status, count, revenue):
+    await db[STATE_COLLECTION].update_one(
+        {'_id': 'totals'},
+        {'$inc': {f'by_status.{status}.count': count, f'by_status.{status}.revenue': revenue}},
+        upsert=True
+    )
+
+
+async def discard_archive_copy(db, order_id):
+    """Drop a copy the archiver made of a hot order that is being deleted, before it is counted"""
+    await db[ARCHIVE_COLLECTION].delete_many({'id': order_id, 'archive_state': 'copied'})
+
+
+async def delete_archived_order(db, order_id):
+    """Delete an order from the archive, taking it out of the totals if it was counted; returns whether it existed"""
+    removed = await db[ARCHIVE_COLLECTION].find_one_and_delete(
+        {'id': order_id}, projection={'_id': 0, 'status': 1, 'total': 1, 'archive_state': 1, 'archive_batch': 1}
+    )
+    if removed is None:
+        return False
+    counted = removed.get('archive_state', 'counted') == 'counted'
+    if removed.get('archive_state') == 'counting':
+        # Counted once its batch is in the totals, even before the order is marked
+        counted = await db[STATE_COLLECTION].count_documents(
+            {'_id': 'totals', 'applied_batches': removed['archive_batch']}
+        ) > 0
+    if counted:
+        await adjust_archived_totals(db, removed['status'], -1, -removed.get('total', 0))
+    return True
+
+
+class OrderArchiver:
+    def __init__(self, after_days=30, batch_size=500, interval_s=3600.0, lease_s=600.0, enabled=True):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.lease_s = lease_s
+        self.enabled = enabled
+        self.owner = str(uuid.uuid4())
+        self._task = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            after_days=float(environ.get('ORDER_ARCHIVE_AFTER_DAYS', 30)),
+            batch_size=int(environ.get('ORDER_ARCHIVE_BATCH', 500)),
+            interval_s=float(environ.get('ORDER_ARCHIVE_INTERVAL_S', 3600)),
+            enabled=environ.get('ORDER_ARCHIVE_ENABLED', 'true').lower() == 'true',
+        )
+
+    def cutoff(self, now=None):
+        """Orders created before this instant may be in the archive"""
+        return (now or datetime.now(timezone.utc)) - timedelta(days=self.after_days)
+
+    async def start(self, db):
+        await db[ARCHIVE_COLLECTION].create_index('id', unique=True)
+        await db[ARCHIVE_COLLECTION].create_index('created_at')
+        await db[ARCHIVE_COLLECTION].create_index('archive_state')
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, db):
+        while True:
+            try:
+                archived = await self.run_once(db)
+                if archived:
+                    logger.info(f"Archived {archived} order(s)")
+            except Exception:
+                logger.exception("Order archiving failed")
+            await asyncio.sleep(self.interval_s)
+
+    async def _take_lease(self, db, now):
+        """Take or renew the archiving lease; False while another live worker holds it"""
+        try:
+            await db[STATE_COLLECTION].find_one_and_update(
+                {'_id': 'lease', '$or': [{'owner': self.owner}, {'expires_at': {'$lt': now.isoformat()}}]},
+                {'$set': {'owner': self.owner, 'expires_at': (now + timedelta(seconds=self.lease_s)).isoformat()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # The lease exists and belongs to another live worker
+            return False
+
+    async def _release_lease(self, db):
+        await db[STATE_COLLECTION].delete_one({'_id': 'lease', 'owner': self.owner})
+
+    async def run_once(self, db, max_batches=None):
+        """Archive eligible orders batch by batch; returns how many were moved"""
+        if not await self._take_lease(db, datetime.now(timezone.utc)):
+            return 0
+        archived = 0
+        batches = 0
+        try:
+            archived += await self._recover(db)
+            while max_batches is None or batches < max_batches:
+                fetched, moved = await self._archive_batch(db)
+                archived += moved
+                batches += 1
+                if fetched < self.batch_size:
+                    break
+                if not await self._take_lease(db, datetime.now(timezone.utc)):
+                    logger.warning("Lost the order archiving lease to another worker; stopping this pass")
+                    break
+        finally:
+            await self._release_lease(db)
+        return archived
+
+    async def _archive_batch(self, db):
+        """Move one batch; returns (orders read, orders this worker moved)"""
+        orders = await db.orders.find(
+            {'status': {'$in': list(FINAL_STATUSES)}, 'created_at': {'$lt': self.cutoff().isoformat()}},
+            {'_id': 0}
+        ).sort('created_at', 1).to_list(self.batch_size)
+        if not orders:
+            return 0, 0
+
+        # $set keeps the bookkeeping state of a copy another pass already made
+        await db[ARCHIVE_COLLECTION].bulk_write(
+            [UpdateOne({'id': order['id']}, {'$set': order, '$setOnInsert': {'archive_state': 'copied'}}, upsert=True)
+             for order in orders],
+            ordered=False
+        )
+        # Only delete what has not changed since it was copied; each result says whether this worker moved it
+        deleted = await asyncio.gather(*(
+            db.orders.find_one_and_delete(
+                {'id': order['id'], 'status': order['status'], 'updated_at': order.get('updated_at')},
+                projection={'_id': 0, 'id': 1}
+            )
+            for order in orders
+        ))
+        moved = [doc['id'] for doc in deleted if doc is not None]
+
+        not_moved = [order['id'] for order in orders if order['id'] not in set(moved)]
+        if not_moved:
+            # Changed while being archived (the hot order stays authoritative) or deleted meanwhile;
+            # a copy left behind would be counted by _recover as an order this pass moved
+            await db[ARCHIVE_COLLECTION].delete_many({'id': {'$in': not_moved}, 'archive_state': 'copied'})
+
+        if moved:
+            await self._count(db, moved)
+        return len(orders), len(moved)
+
+    async def _count(self, db, order_ids):
+        """Claim uncounted archive copies into a new batch and add it to the totals"""
+        batch_id = str(uuid.uuid4())
+        await db[ARCHIVE_COLLECTION].update_many(
+            {'id': {'$in': order_ids}, 'archive_state': 'copied'},
+            {'$set': {'archive_state': 'counting', 'archive_batch': batch_id}}
+        )
+        await self._apply_batch(db, batch_id)
+
+    async def _apply_batch(self, db, batch_id):
+        rows = await db[ARCHIVE_COLLECTION].aggregate([
+            {'$match': {'archive_batch': batch_id, 'archive_state': 'counting'}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'revenue': {'$sum': '$total'}}}
+        ]).to_list(None)
+        if rows:
+            increments = {}
+            for row in rows:
+                increments[f"by_status.{row['_id']}.count"] = row['count']
+                increments[f"by_status.{row['_id']}.revenue"] = row['revenue']
+            try:
+                await db[STATE_COLLECTION].update_one(
+                    {'_id': 'totals', 'applied_batches': {'$ne': batch_id}},
+                    {'$inc': increments,
+                     '$push': {'applied_batches': {'$each': [batch_id], '$slice': -APPLIED_BATCHES_KEPT}}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # The batch is already in the totals; the upsert found no document without it
+                pass
+        await db[ARCHIVE_COLLECTION].update_many(
+            {'archive_batch': batch_id},
+            {'$set': {'archive_state': 'counted'}, '$unset': {'archive_batch': ''}}
+        )
+
+    async def _recover(self, db):
+        """Count what a crashed pass moved but did not finish counting; returns how many orders that was"""
+        for batch_id in await db[ARCHIVE_COLLECTION].distinct('archive_batch', {'archive_state': 'counting'}):
+            await self._apply_batch(db, batch_id)
+
+        copied = await db[ARCHIVE_COLLECTION].find({'archive_state': 'copied'}, {'_id': 0, 'id': 1}).to_list(None)
+        if not copied:
+            return 0
+        ids = [doc['id'] for doc in copied]
+        hot = {o['id'] for o in await db.orders.find({'id': {'$in': ids}}, {'_id': 0, 'id': 1}).to_list(None)}
+        # Still in orders: the next batch copies and moves them again
+        orphaned = [order_id for order_id in ids if order_id not in hot]
+        if orphaned:
+            await self._count(db, orphaned)
+        return len(orphaned)
@@ -0,0 +1,224 @@
+"""Sampling profiler and event-loop stall monitor for a running worker.
+
+``SamplingProfiler`` records the Python stack of the event loop thread (or of
+every thread) from a background thread every few milliseconds for a fixed
+time, while the worker keeps serving requests. The result is rendered as
+collapsed stacks (``thread;frame;frame weight`` lines with weights in
+milliseconds, the input of flamegraph.pl and most flame graph viewers) or as
+a speedscope profile (https://www.speedscope.app).
+
+``LoopStallMonitor`` runs a watchdog thread next to a heartbeat task on the
+event loop. When the heartbeat is late by more than
+``LOOP_STALL_THRESHOLD_MS``, whatever is running on the loop is blocking it:
+the watchdog logs the loop thread's stack and the route whose handler is on
+that stack, and counts the stall in ``event_loop_stalls_total``.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from functools import lru_cache
+
+from metrics import EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+# Innermost frames logged for a stall; the outer ones are the same ASGI plumbing every time
+STACK_LIMIT = 25
+
+
+@lru_cache(maxsize=4096)
+def short_path(filename):
+    """``filename`` relative to the sys.path entry it was imported from"""
+    for entry in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(entry + os.sep):
+            return filename[len(entry) + 1:]
+    return filename
+
+
+def frame_key(frame):
+    code = frame.f_code
+    # co_qualname is new in Python 3.11
+    return getattr(code, 'co_qualname', code.co_name), short_path(code.co_filename), code.co_firstlineno
+
+
+def stack_keys(frame):
+    """Frames of a stack, outermost first"""
+    keys = []
+    while frame is not None:
+        keys.append(frame_key(frame))
+        frame = frame.f_back
+    keys.reverse()
+    return keys
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    async def capture(self, seconds, interval_s, thread_id=None):
+        """Sample for ``seconds``; only ``thread_id`` when given, otherwise every thread but the sampler"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already being captured")
+        try:
+            return await asyncio.to_thread(self._sample, seconds, interval_s, thread_id)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds, interval_s, thread_id):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = {}
+        start = last = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            time.sleep(interval_s)
+            now = time.perf_counter()
+            # Weigh each sample by the time it stands for; the GIL can delay the sampler
+            elapsed_ms = (now - last) * 1000
+            last = now
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (thread_id is not None and ident != thread_id):
+                    continue
+                thread = names.get(ident) or f"thread-{ident}"
+                stacks.setdefault(thread, Counter())[tuple(stack_keys(frame))] += elapsed_ms
+            if now >= deadline:
+                break
+        return Profile(stacks, (last - start) * 1000)
+
+
+class Profile:
+    def __init__(self, stacks, duration_ms):
+        self.stacks = stacks  # {thread name: Counter({(frame key, ...): weight in ms})}
+        self.duration_ms = duration_ms
+
+    def collapsed(self):
+        """One ``thread;file:function;... milliseconds`` line per distinct stack"""
+        lines = []
+        for thread, stacks in self.stacks.items():
+            for stack, weight_ms in stacks.most_common():
+                frames = ';'.join(f"{path}:{name}" for name, path, _ in stack)
+                lines.append(f"{thread};{frames} {max(1, round(weight_ms))}")
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name='teruza'):
+        frames = []
+        index = {}
+        profiles = []
+        for thread, stacks in self.stacks.items():
+            samples = []
+            weights = []
+            for stack, weight_ms in stacks.items():
+                sample = []
+                for key in stack:
+                    if key not in index:
+                        index[key] = len(frames)
+                        frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                    sample.append(index[key])
+                samples.append(sample)
+                weights.append(round(weight_ms, 3))
+            profiles.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 3),
+                'samples': samples,
+                'weights': weights,
+            })
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'teruza',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': profiles,
+        }
+
+
+class LoopStallMonitor:
+    def __init__(self, threshold_ms=100.0, enabled=True):
+        self.threshold_ms = threshold_ms
+        self.enabled = enabled and threshold_ms > 0
+        self._interval_s = threshold_ms / 4000
+        self._beat = 0.0
+        self._loop_thread = None
+        self._routes = {}
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            threshold_ms=float(environ.get('LOOP_STALL_THRESHOLD_MS', 100)),
+            enabled=environ.get('LOOP_STALL_MONITOR', 'true').lower() == 'true',
+        )
+
+    async def start(self, routes=()):
+        """Start watching the running loop; ``routes`` map handler frames on a stalled stack to a route"""
+        if not self.enabled or self._task is not None:
+            return
+        self._routes = {
+            route.endpoint.__code__: f"{' '.join(sorted(route.methods))} {route.path}"
+            for route in routes if hasattr(route, 'endpoint') and getattr(route, 'methods', None)
+        }
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-stall-monitor', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        self._task = None
+        self._watchdog.join(timeout=1)
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self._interval_s)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self._interval_s):
+            beat = self._beat
+            # The heartbeat sleeps one interval between beats; anything beyond that is the loop being blocked
+            blocked_ms = (time.monotonic() - beat - self._interval_s) * 1000
+            if blocked_ms < self.threshold_ms or beat == reported_beat:
+                continue
+            # Report each stall once, while it is still happening
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            route = self.route_of(frame)
+            EVENT_LOOP_STALLS.labels(route or 'unknown').inc()
+            logger.warning(
+                f"Event loop blocked for over {blocked_ms:.0f} ms in {route or 'no request handler'}:\n"
+                + ''.join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            )
+
+    def route_of(self, frame):
+        """Route of the innermost request handler on the stack, if any"""
+        while frame is not None:
+            route = self._routes.get(frame.f_code)
+            if route is not None:
+                return route
+            frame = frame.f_back
+        return None
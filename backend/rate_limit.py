@@ -0,0 +1,271 @@
+"""Rate limiting and load shedding for the public write endpoints.
+
+``RateLimiter`` keeps an in-memory token bucket per client and route. Every
+request spends a token from the bucket of its client IP (``RATE_LIMITS``),
+sized for all the guests behind the hostel NAT together. Requests that name
+a browser session in ``X-Session-Id`` (the anonymous id the frontend already
+uses for analytics) also spend one from that session's bucket
+(``SESSION_RATE_LIMITS``), so one guest cannot use up the whole IP's share.
+The session id is chosen by the client, so it only ever adds a limit: a new
+id per request still hits the IP bucket, and session buckets are kept apart
+from the IP buckets so they cannot push those out. Behind a proxy, set
+``FORWARDED_HOPS`` to the number of trusted proxies so the IP is read from
+``X-Forwarded-For``; an error is logged when forwarded requests arrive
+without it. Set ``RATE_LIMITS=`` and ``SESSION_RATE_LIMITS=`` (empty) to turn
+rate limiting off.
+
+Limits are comma separated lists of
+``METHOD /route/template=COUNT/PERIOD[:BURST]`` entries where PERIOD is
+``s``, ``m`` or ``h`` and BURST defaults to COUNT. Buckets live in each
+worker, so with several uvicorn workers a client gets up to that many times
+the configured rate.
+
+``LoadShedder`` rejects requests to the same routes up front while the worker
+is overloaded: when the event loop lags behind by more than
+``SHED_LOOP_LAG_MS`` or more than ``SHED_POOL_QUEUE`` operations are waiting
+for a Mongo connection. ``PoolQueueMonitor`` is the pymongo pool listener
+that counts those waiters.
+
+``RateLimitMiddleware`` answers rate limited requests with 429 and shed
+requests with 503, both with ``Retry-After``, before any database work.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import monitoring
+from starlette.responses import JSONResponse
+
+from metrics import EVENT_LOOP_LAG, HTTP_REQUESTS_REJECTED
+from request_context import UNMATCHED_ROUTE, route_for_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMITS = 'POST /api/analytics/track=600/m:120,POST /api/orders=30/m:10'
+DEFAULT_SESSION_RATE_LIMITS = 'POST /api/analytics/track=120/m:30,POST /api/orders=10/m:5'
+PERIODS = {'s': 1.0, 'm': 60.0, 'h': 3600.0}
+SESSION_HEADER = b'x-session-id'
+MAX_SESSION_ID_LENGTH = 128
+
+
+def parse_rate_limits(spec):
+    """``{'POST /api/orders': (tokens_per_second, burst)}`` from a RATE_LIMITS string"""
+    limits = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        route, _, rate = entry.rpartition('=')
+        rate, _, burst = rate.partition(':')
+        count, _, period = rate.partition('/')
+        if not route or period not in PERIODS:
+            raise ValueError(f"Invalid rate limit {entry!r}, expected 'METHOD /route=COUNT/s|m|h[:BURST]'")
+        limits[route.strip()] = (float(count) / PERIODS[period], float(burst or count))
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, now):
+        """Spend a token; returns 0 when allowed, otherwise seconds until one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits, max_buckets=10_000):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+
+    def check(self, route, client):
+        """Seconds the client has to wait before calling ``route`` again; 0 if allowed"""
+        limit = self.limits.get(route)
+        if limit is None:
+            return 0.0
+        now = time.monotonic()
+        key = (route, client)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit, now)
+            # Forget the least recently seen clients; a forgotten client starts with a full bucket
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+
+class PoolQueueMonitor(monitoring.ConnectionPoolListener):
+    """Number of operations currently waiting for a pooled Mongo connection"""
+
+    def __init__(self):
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def _add(self, delta):
+        with self._lock:
+            self.waiting += delta
+
+    def connection_check_out_started(self, event):
+        self._add(1)
+
+    def connection_check_out_failed(self, event):
+        self._add(-1)
+
+    def connection_checked_out(self, event):
+        self._add(-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class LoadShedder:
+    def __init__(self, max_loop_lag_ms=200.0, max_pool_queue=0, interval_s=0.1, pool_monitor=None):
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.max_pool_queue = max_pool_queue
+        self.interval_s = interval_s
+        self.pool_monitor = pool_monitor
+        self.loop_lag_ms = 0.0
+        self._task = None
+
+    async def start(self):
+        if self.max_loop_lag_ms > 0 and self._task is None:
+            self._task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            # Rise immediately, decay over a few ticks so one quiet tick does not reopen the gate
+            self.loop_lag_ms = max(lag_ms, self.loop_lag_ms * 0.5)
+            EVENT_LOOP_LAG.set(self.loop_lag_ms / 1000)
+
+    def overload_reason(self):
+        """Why new work should be refused right now, or None"""
+        if self.max_loop_lag_ms > 0 and self.loop_lag_ms > self.max_loop_lag_ms:
+            return 'loop_lag'
+        if self.max_pool_queue > 0 and self.pool_monitor is not None \
+                and self.pool_monitor.waiting > self.max_pool_queue:
+            return 'pool_queue'
+        return None
+
+
+def client_address(scope, forwarded_hops=0):
+    """Client IP; with ``forwarded_hops`` trusted proxies in front, read it from X-Forwarded-For"""
+    if forwarded_hops > 0:
+        for name, value in scope.get('headers', []):
+            if name == b'x-forwarded-for':
+                hops = [hop.strip() for hop in value.decode('latin-1').split(',') if hop.strip()]
+                if hops:
+                    return hops[-min(forwarded_hops, len(hops))]
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def session_id(scope):
+    """Browser session named in X-Session-Id, or None"""
+    for name, value in scope.get('headers', []):
+        if name == SESSION_HEADER:
+            session = value.decode('latin-1').strip()
+            if session and len(session) <= MAX_SESSION_ID_LENGTH:
+                return session
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter, session_limiter=None, shedder=None, shed_routes=None, forwarded_hops=0):
+        self.app = app
+        self.limiter = limiter
+        self.session_limiter = session_limiter
+        self.shedder = shedder
+        self.shed_routes = set(limiter.limits if shed_routes is None else shed_routes)
+        self.forwarded_hops = forwarded_hops
+        self._warned_proxy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = scope.get('state', {}).get('route_template')
+        if route is None:
+            route = route_for_path(scope['app'], scope) if 'app' in scope else UNMATCHED_ROUTE
+        route = f"{scope['method']} {route}"
+
+        if self.shedder is not None and route in self.shed_routes:
+            reason = self.shedder.overload_reason()
+            if reason is not None:
+                HTTP_REQUESTS_REJECTED.labels(route, reason).inc()
+                response = JSONResponse(
+                    status_code=503,
+                    content={'detail': 'Server is busy, please retry shortly'},
+                    headers={'Retry-After': '1'},
+                )
+                await response(scope, receive, send)
+                return
+
+        if not self._warned_proxy and self.forwarded_hops <= 0 and route in self.limiter.limits \
+                and any(name == b'x-forwarded-for' for name, _ in scope.get('headers', [])):
+            self._warned_proxy = True
+            logger.error(
+                "Rate limited requests arrive through a proxy (X-Forwarded-For) but FORWARDED_HOPS is not set: "
+                "every client shares the proxy's rate limit bucket"
+            )
+        retry_after = self.limiter.check(route, client_address(scope, self.forwarded_hops))
+        if retry_after == 0 and self.session_limiter is not None:
+            # Only checked once the IP bucket let the request in, so made-up ids cost a token each
+            session = session_id(scope)
+            if session is not None:
+                retry_after = self.session_limiter.check(route, session)
+        if retry_after > 0:
+            HTTP_REQUESTS_REJECTED.labels(route, 'rate_limit').inc()
+            response = JSONResponse(
+                status_code=429,
+                content={'detail': 'Too many requests'},
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,100 @@
+"""Per-request context shared by middleware, metrics and Mongo listeners.
+
+``RequestContextMiddleware`` resolves the route template of each request once
+and stores it in ``current_route``. It also opens a ``DbCallStats`` for the
+request; ``record_db_call`` is a storage command observer that adds every
+database round trip to it. Motor copies the current context into the
+executor thread that runs each pymongo operation, so listeners and observers
+can attribute database work to the request that issued it.
+
+Outside of HTTP requests, ``track_db_calls()`` opens the same accounting for
+a block of code, which is how query-count budgets are asserted.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.routing import Match
+
+UNMATCHED_ROUTE = 'unmatched'
+
+current_route: ContextVar[str] = ContextVar('current_route', default='')
+
+
+class DbCallStats:
+    def __init__(self):
+        self.calls = 0
+        self.time_s = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration_s):
+        with self._lock:
+            self.calls += 1
+            self.time_s += duration_s
+
+    @property
+    def time_ms(self):
+        return self.time_s * 1000
+
+
+current_db_stats: ContextVar[Optional[DbCallStats]] = ContextVar('current_db_stats', default=None)
+
+
+def record_db_call(collection, command_name, duration_s, succeeded):
+    """Storage command observer counting round trips for the current request"""
+    stats = current_db_stats.get()
+    if stats is not None:
+        stats.add(duration_s)
+
+
+@contextmanager
+def track_db_calls():
+    stats = DbCallStats()
+    token = current_db_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_db_stats.reset(token)
+
+
+def route_for_path(app, scope):
+    """Resolve the route template before the request is handled"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, 'path_format', None) or route.path
+    return UNMATCHED_ROUTE
+
+
+class RequestContextMiddleware:
+    """Sets the request route and DB accounting; optionally reports it as
+    ``X-DB-Calls`` / ``X-DB-Time-ms`` response headers"""
+
+    def __init__(self, app, expose_db_headers=False):
+        self.app = app
+        self.expose_db_headers = expose_db_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        route = route_for_path(scope['app'], scope) if 'app' in scope else UNMATCHED_ROUTE
+        scope.setdefault('state', {})['route_template'] = route
+        stats = DbCallStats()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and self.expose_db_headers:
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-db-calls', str(stats.calls).encode()),
+                    (b'x-db-time-ms', f"{stats.time_ms:.2f}".encode()),
+                ]
+            await send(message)
+
+        route_token = current_route.set(f"{scope['method']} {route}")
+        stats_token = current_db_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_db_stats.reset(stats_token)
+            current_route.reset(route_token)
@@ -1,27 +1,108 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
+import asyncio
+import random
+import threading
+import time
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import base64
 from enum import Enum
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from storage import create_storage
+from metrics import MongoPoolMetricsListener, PrometheusMiddleware, metrics_response, record_mongo_command
+from request_context import RequestContextMiddleware, record_db_call
+from slow_queries import SLOW_QUERIES_COLLECTION, SlowQueryLog
+from catalog_cache import CatalogSnapshots
+from unique_counts import UniqueCounter
+from order_archive import (
+    ARCHIVE_COLLECTION, ARCHIVE_PROJECTION, OrderArchiver, archived_totals,
+    delete_archived_order, discard_archive_copy,
+)
+from analytics_retention import AnalyticsRetention
+from idempotency import IdempotencyStore
+from profiling import PROFILE_MAX_SECONDS, LoopStallMonitor, SamplingProfiler
+from exports import (
+    ANALYTICS_COLUMNS, EXPORT_BATCH_SIZE, MEDIA_TYPES, ORDER_COLUMNS,
+    analytics_row, merge_sorted, order_row, stream_export,
+)
+from rate_limit import (
+    DEFAULT_RATE_LIMITS,
+    DEFAULT_SESSION_RATE_LIMITS,
+    LoadShedder,
+    PoolQueueMonitor,
+    RateLimiter,
+    RateLimitMiddleware,
+    parse_rate_limits,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Slow query log
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+    explain=os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true',
+    explain_interval_s=float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 60)),
+    size_bytes=int(os.environ.get('SLOW_QUERY_LOG_SIZE_MB', 16)) * 1024 * 1024,
+)
+
+# MongoDB connection (STORAGE_BACKEND=memory runs without a database server).
+# Pool size, timeouts and compression come from MONGO_* variables, see storage.py
+db_observers = [record_mongo_command, record_db_call]
+pool_queue = PoolQueueMonitor()
+db = create_storage(
+    command_observers=db_observers,
+    event_listeners=[slow_query_log, MongoPoolMetricsListener(), pool_queue],
+)
+
+# Per-IP and per-session token buckets and overload shedding for the unauthenticated writes, see rate_limit.py
+rate_limiter = RateLimiter(
+    parse_rate_limits(os.environ.get('RATE_LIMITS', DEFAULT_RATE_LIMITS)),
+    max_buckets=int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000)),
+)
+session_rate_limiter = RateLimiter(
+    parse_rate_limits(os.environ.get('SESSION_RATE_LIMITS', DEFAULT_SESSION_RATE_LIMITS)),
+    max_buckets=int(os.environ.get('RATE_LIMIT_MAX_SESSIONS', 10000)),
+)
+load_shedder = LoadShedder(
+    max_loop_lag_ms=float(os.environ.get('SHED_LOOP_LAG_MS', 200)),
+    max_pool_queue=int(os.environ.get('SHED_POOL_QUEUE', 50)),
+    pool_monitor=pool_queue,
+)
+
+# On-demand profiles of this worker and logs of event loop stalls, see profiling.py
+sampling_profiler = SamplingProfiler()
+loop_stall_monitor = LoopStallMonitor.from_env()
+
+# Precompressed /products, /categories and /catalog responses, invalidated by catalog writes
+catalog_snapshots = CatalogSnapshots.from_env()
+CATALOG_TOMBSTONES_COLLECTION = 'catalog_tombstones'
+
+# Distinct viewers/buyers per product and day, see unique_counts.py
+unique_counter = UniqueCounter(flush_interval_s=float(os.environ.get('ANALYTICS_SKETCH_FLUSH_S', 10)))
+# Share of raw view events to store (0 keeps none); unique viewers are counted regardless
+ANALYTICS_VIEW_SAMPLE_RATE = float(os.environ.get('ANALYTICS_VIEW_SAMPLE_RATE', 1.0))
+
+# Finished orders older than ORDER_ARCHIVE_AFTER_DAYS move to orders_archive, see order_archive.py
+order_archiver = OrderArchiver.from_env()
+
+# Raw analytics expire after ANALYTICS_RETENTION_DAYS; daily rollups keep reports whole, see analytics_retention.py
+analytics_retention = AnalyticsRetention.from_env()
+
+# Idempotency-Key support for POST /orders, see idempotency.py
+idempotency_store = IdempotencyStore.from_env()
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'teruza-hostel-secret-key-2025')
@@ -38,6 +119,14 @@ class ProductType(str, Enum):
     product = "product"
     service = "service"
 
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+class ProfileFormat(str, Enum):
+    collapsed = "collapsed"
+    speedscope = "speedscope"
+
 # Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -61,7 +150,8 @@ class Product(BaseModel):
     active: bool = True
     featured: bool = False
     type: ProductType
-    category: str
+    category_id: Optional[str] = None
+    category: str  # name_pt of category_id, kept in sync on renames
     price: float
     currency: str = "BRL"
     image_url: Optional[str] = None
@@ -78,7 +168,8 @@ class ProductCreate(BaseModel):
     active: bool = True
     featured: bool = False
     type: ProductType
-    category: str
+    category_id: Optional[str] = None
+    category: Optional[str] = None  # name_pt, accepted when category_id is not given
     price: float
     currency: str = "BRL"
     image_url: Optional[str] = None
@@ -93,6 +184,7 @@ class ProductUpdate(BaseModel):
     active: Optional[bool] = None
     featured: Optional[bool] = None
     type: Optional[ProductType] = None
+    category_id: Optional[str] = None
     category: Optional[str] = None
     price: Optional[float] = None
     currency: Optional[str] = None
@@ -114,6 +206,8 @@ class Category(BaseModel):
     name_en: str
     name_es: str
     image_url: Optional[str] = None
+    product_count: int = 0
+    active_product_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -157,6 +251,7 @@ class OrderCreate(BaseModel):
     notes: Optional[str] = None
     items: List[OrderItem]
     total: float
+    session_id: Optional[str] = Field(default=None, max_length=64)
 
 class OrderStatusUpdate(BaseModel):
     status: str
@@ -171,6 +266,7 @@ class ProductAnalytics(BaseModel):
 class AnalyticsEvent(BaseModel):
     product_id: str
     event_type: str
+    session_id: Optional[str] = Field(default=None, max_length=64)  # anonymous, per browser
 
 class Settings(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -209,82 +305,320 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Seeding runs at most once per deployment: the first worker to claim the
+# seed_state lock document seeds, every other worker skips straight to serving.
+# A failed or abandoned seed is taken over by the next readiness check of any worker.
+# 2: products reference categories by id, per-category product counts
+# 3: analytics timestamps stored as native datetimes (rollups and retention)
+SEED_VERSION = 3
+SEED_LOCK_TIMEOUT = timedelta(minutes=5)
+SEED_RETRY_DELAY = timedelta(seconds=30)
+seed_complete = False
+
+# Unique indexes that keep concurrent seeding and writes from creating duplicates
+UNIQUE_INDEXES = [
+    ('users', 'email'),
+    ('categories', 'id'),
+    ('categories', 'name_pt'),
+    ('products', 'id'),
+    ('orders', 'id'),
+]
+
+# Catalog writes stamp the catalog version they were made at; /catalog?since= scans these
+INDEXES = [
+    ('products', 'catalog_version'),
+    ('products', 'category_id'),
+    ('orders', 'created_at'),
+    ('categories', 'catalog_version'),
+    (CATALOG_TOMBSTONES_COLLECTION, 'catalog_version'),
+]
+
+async def ensure_indexes():
+    for collection, field in UNIQUE_INDEXES:
+        try:
+            await db[collection].create_index(field, unique=True)
+        except OperationFailure as e:
+            # Pre-existing duplicates (e.g. from older racing seeders) block the index
+            logging.warning(f"Could not create unique index {collection}.{field}: {e}")
+    for collection, field in INDEXES:
+        await db[collection].create_index(field)
+    await idempotency_store.ensure_indexes(db)
+
+async def record_tombstone(kind: str, item_id: str, catalog_version: int):
+    """Remember a catalog deletion so delta syncs can report it"""
+    await db[CATALOG_TOMBSTONES_COLLECTION].insert_one({
+        'kind': kind,
+        'id': item_id,
+        'catalog_version': catalog_version,
+        'deleted_at': datetime.now(timezone.utc).isoformat()
+    })
+
 # Initialize default admin user
 async def init_admin_user():
     admin_email = "admin@teruza.com"
-    existing_admin = await db.users.find_one({'email': admin_email}, {'_id': 0})
-    if not existing_admin:
-        admin_user = User(
-            email=admin_email,
-            password_hash=hash_password("password123"),
-            is_admin=True
-        )
-        doc = admin_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.users.insert_one(doc)
+    existing_admin = await db.users.find_one({'email': admin_email}, {'_id': 1})
+    if existing_admin:
+        return
+    
+    # bcrypt is deliberately slow; keep it off the event loop
+    password_hash = await asyncio.to_thread(hash_password, "password123")
+    admin_user = User(
+        email=admin_email,
+        password_hash=password_hash,
+        is_admin=True
+    )
+    doc = admin_user.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    result = await db.users.update_one({'email': admin_email}, {'$setOnInsert': doc}, upsert=True)
+    if result.upserted_id is not None:
         logging.info(f"Default admin user created: {admin_email}")
 
+DEFAULT_CATEGORIES = [
+    {
+        'name_pt': 'Bebidas',
+        'name_en': 'Drinks',
+        'name_es': 'Bebidas',
+        'image_url': 'https://images.unsplash.com/photo-1632852521784-d85d5b62dd62'
+    },
+    {
+        'name_pt': 'Snacks',
+        'name_en': 'Snacks',
+        'name_es': 'Snacks',
+        'image_url': 'https://images.unsplash.com/photo-1641693148759-843d17ceac24'
+    },
+    {
+        'name_pt': 'Refeições Rápidas',
+        'name_en': 'Quick Meals',
+        'name_es': 'Comidas Rápidas',
+        'image_url': 'https://images.unsplash.com/photo-1762631884747-8dabb217e11b'
+    },
+    {
+        'name_pt': 'Higiene',
+        'name_en': 'Hygiene',
+        'name_es': 'Higiene',
+        'image_url': 'https://images.unsplash.com/photo-1750271336429-8b0a507785c0'
+    },
+    {
+        'name_pt': 'Emergências',
+        'name_en': 'Essentials',
+        'name_es': 'Esenciales',
+        'image_url': 'https://images.unsplash.com/photo-1564144573017-8dc932e0039e'
+    },
+    {
+        'name_pt': 'Serviços',
+        'name_en': 'Services',
+        'name_es': 'Servicios',
+        'image_url': 'https://images.unsplash.com/photo-1724847885015-be191f1a47ef'
+    }
+]
+
 # Initialize default categories
 async def init_default_categories():
-    default_categories = [
-        {
-            'name_pt': 'Bebidas',
-            'name_en': 'Drinks',
-            'name_es': 'Bebidas',
-            'image_url': 'https://images.unsplash.com/photo-1632852521784-d85d5b62dd62'
-        },
-        {
-            'name_pt': 'Snacks',
-            'name_en': 'Snacks',
-            'name_es': 'Snacks',
-            'image_url': 'https://images.unsplash.com/photo-1641693148759-843d17ceac24'
-        },
-        {
-            'name_pt': 'Refeições Rápidas',
-            'name_en': 'Quick Meals',
-            'name_es': 'Comidas Rápidas',
-            'image_url': 'https://images.unsplash.com/photo-1762631884747-8dabb217e11b'
-        },
-        {
-            'name_pt': 'Higiene',
-            'name_en': 'Hygiene',
-            'name_es': 'Higiene',
-            'image_url': 'https://images.unsplash.com/photo-1750271336429-8b0a507785c0'
-        },
-        {
-            'name_pt': 'Emergências',
-            'name_en': 'Essentials',
-            'name_es': 'Esenciales',
-            'image_url': 'https://images.unsplash.com/photo-1564144573017-8dc932e0039e'
-        },
-        {
-            'name_pt': 'Serviços',
-            'name_en': 'Services',
-            'name_es': 'Servicios',
-            'image_url': 'https://images.unsplash.com/photo-1724847885015-be191f1a47ef'
-        }
-    ]
-    
-    for cat_data in default_categories:
-        existing = await db.categories.find_one({'name_pt': cat_data['name_pt']}, {'_id': 0})
-        if not existing:
+    # Runs once per deployment, so always take a version for the categories it may insert
+    async with catalog_snapshots.write(db) as catalog_version:
+        operations = []
+        for cat_data in DEFAULT_CATEGORIES:
             category = Category(**cat_data)
             doc = category.model_dump()
             doc['created_at'] = doc['created_at'].isoformat()
             doc['updated_at'] = doc['updated_at'].isoformat()
-            await db.categories.insert_one(doc)
-            logging.info(f"Default category created: {cat_data['name_pt']}")
+            doc['catalog_version'] = catalog_version
+            operations.append(UpdateOne({'name_pt': cat_data['name_pt']}, {'$setOnInsert': doc}, upsert=True))
+        
+        result = await db.categories.bulk_write(operations, ordered=False)
+    if result.upserted_count:
+        logging.info(f"Default categories created: {result.upserted_count}")
+
+# Products used to reference categories by name_pt only
+async def migrate_product_categories():
+    categories = await db.categories.find({}, {'_id': 0, 'id': 1, 'name_pt': 1}).to_list(None)
+    operations = [
+        UpdateMany({'category': c['name_pt'], 'category_id': None}, {'$set': {'category_id': c['id']}})
+        for c in categories
+    ]
+    if operations:
+        result = await db.products.bulk_write(operations, ordered=False)
+        if result.modified_count:
+            logging.info(f"Linked {result.modified_count} product(s) to their category id")
+    
+    orphans = await db.products.count_documents({'category_id': None})
+    if orphans:
+        logging.warning(f"{orphans} product(s) reference a category that does not exist")
+
+async def rebuild_category_counts():
+    """Recompute the denormalized product counts from the products collection"""
+    rows = await db.products.aggregate([
+        {'$match': {'category_id': {'$ne': None}}},
+        {'$group': {
+            '_id': '$category_id',
+            'total': {'$sum': 1},
+            'active': {'$sum': {'$cond': [{'$eq': ['$active', True]}, 1, 0]}}
+        }}
+    ]).to_list(None)
+    counts = {row['_id']: row for row in rows}
+    
+    categories = await db.categories.find({}, {'_id': 0, 'id': 1}).to_list(None)
+    if not categories:
+        return
+    async with catalog_snapshots.write(db) as catalog_version:
+        operations = [
+            UpdateOne({'id': c['id']}, {'$set': {
+                'product_count': counts.get(c['id'], {}).get('total', 0),
+                'active_product_count': counts.get(c['id'], {}).get('active', 0),
+                'catalog_version': catalog_version
+            }})
+            for c in categories
+        ]
+        await db.categories.bulk_write(operations, ordered=False)
+
+# Analytics timestamps used to be isoformat strings, which date range queries do not match
+async def migrate_analytics_timestamps(batch_size=1000):
+    converted = 0
+    while True:
+        events = await db.analytics.find(
+            {'timestamp': {'$type': 'string'}}, {'_id': 1, 'timestamp': 1}
+        ).to_list(batch_size)
+        if not events:
+            break
+        await db.analytics.bulk_write([
+            UpdateOne({'_id': e['_id']}, {'$set': {'timestamp': datetime.fromisoformat(e['timestamp'])}})
+            for e in events
+        ], ordered=False)
+        converted += len(events)
+    if converted:
+        logging.info(f"Converted {converted} analytics timestamp(s) to dates")
 
 # Initialize default settings
 async def init_default_settings():
-    existing = await db.settings.find_one({}, {'_id': 0})
-    if not existing:
-        settings = Settings(whatsapp_number='5521988760870')
-        doc = settings.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.settings.insert_one(doc)
+    settings = Settings(whatsapp_number='5521988760870')
+    doc = settings.model_dump()
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    result = await db.settings.update_one({}, {'$setOnInsert': doc}, upsert=True)
+    if result.upserted_id is not None:
         logging.info("Default settings created")
 
+async def claim_seed_lock(state, now):
+    """Atomically take the seed lock; returns False if another worker holds it"""
+    lock = {'status': 'running', 'version': SEED_VERSION, 'started_at': now.isoformat()}
+    if state is None:
+        try:
+            await db.seed_state.insert_one({'_id': 'default', **lock})
+            return True
+        except DuplicateKeyError:
+            return False
+    
+    if state.get('status') == 'running' and state.get('version') == SEED_VERSION:
+        started_at = datetime.fromisoformat(state['started_at'])
+        if now - started_at < SEED_LOCK_TIMEOUT:
+            return False
+    
+    if state.get('status') == 'failed' and state.get('version') == SEED_VERSION:
+        # Do not rerun a seed that keeps failing on every readiness probe
+        if now - datetime.fromisoformat(state['failed_at']) < SEED_RETRY_DELAY:
+            return False
+    
+    # Outdated seed version, a failed seed or a stale lock left by a crashed worker
+    result = await db.seed_state.update_one(
+        {'_id': 'default', 'status': state.get('status'), 'started_at': state.get('started_at')},
+        {'$set': lock}
+    )
+    return result.modified_count == 1
+
+async def seed_defaults():
+    global seed_complete
+    state = await db.seed_state.find_one({'_id': 'default'})
+    if state and state.get('status') == 'done' and state.get('version') == SEED_VERSION:
+        seed_complete = True
+        return
+    
+    started_at = datetime.now(timezone.utc)
+    if not await claim_seed_lock(state, started_at):
+        logging.info("Seeding is being done by another worker or waits to retry a failed seed")
+        return
+    
+    # Only the holder of this lock may finish it; a worker that took it over owns it now
+    lock = {'_id': 'default', 'status': 'running', 'started_at': started_at.isoformat()}
+    try:
+        await init_admin_user()
+        await init_default_categories()
+        await init_default_settings()
+        await migrate_product_categories()
+        await rebuild_category_counts()
+        await migrate_analytics_timestamps()
+    except Exception as e:
+        logging.exception("Seeding default data failed")
+        await db.seed_state.update_one(
+            lock,
+            {'$set': {'status': 'failed', 'failed_at': datetime.now(timezone.utc).isoformat(),
+                      'error': f"{e.__class__.__name__}: {e}"}}
+        )
+        return
+    await db.seed_state.update_one(
+        lock,
+        {'$set': {'status': 'done', 'completed_at': datetime.now(timezone.utc).isoformat()},
+         '$unset': {'failed_at': '', 'error': ''}}
+    )
+    seed_complete = True
+    logging.info(f"Default data seeded (version {SEED_VERSION})")
+
+async def is_seed_complete():
+    """Whether default data is seeded; takes over a failed or abandoned seed"""
+    global seed_complete
+    if not seed_complete:
+        state = await db.seed_state.find_one({'_id': 'default'}, {'_id': 0})
+        seed_complete = bool(state and state.get('status') == 'done' and state.get('version') == SEED_VERSION)
+        if not seed_complete:
+            await seed_defaults()
+    return seed_complete
+
+def as_utc(value: datetime) -> datetime:
+    """Naive query bounds are taken as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def iso_utc(value: datetime) -> str:
+    """Stored order timestamps are UTC isoformat strings"""
+    return as_utc(value).isoformat()
+
+async def find_order(order_id: str):
+    """An order from the hot collection, or from the archive; returns (order, archived)"""
+    order = await db.orders.find_one({'id': order_id}, {'_id': 0})
+    if order:
+        return order, False
+    order = await db[ARCHIVE_COLLECTION].find_one({'id': order_id}, ARCHIVE_PROJECTION)
+    return order, order is not None
+
+async def resolve_category(category_id: Optional[str], category_name: Optional[str]):
+    if category_id:
+        query = {'id': category_id}
+    elif category_name:
+        query = {'name_pt': category_name}
+    else:
+        raise HTTPException(status_code=400, detail="Category is required")
+    
+    category = await db.categories.find_one(query, {'_id': 0, 'id': 1, 'name_pt': 1})
+    if not category:
+        raise HTTPException(status_code=400, detail="Category not found")
+    return category
+
+async def adjust_category_counts(before: Optional[dict], after: Optional[dict], catalog_version: int):
+    """Move a product's contribution to the category counts from its old state to its new one"""
+    deltas = {}
+    for product, sign in ((before, -1), (after, 1)):
+        if product and product.get('category_id'):
+            delta = deltas.setdefault(product['category_id'], {'product_count': 0, 'active_product_count': 0})
+            delta['product_count'] += sign
+            if product.get('active'):
+                delta['active_product_count'] += sign
+    
+    operations = [
+        UpdateOne({'id': category_id}, {'$inc': delta, '$set': {'catalog_version': catalog_version}})
+        for category_id, delta in deltas.items() if any(delta.values())
+    ]
+    if operations:
+        await db.categories.bulk_write(operations, ordered=False)
+
 
 # Auth Routes
 @api_router.post("/auth/login", response_model=TokenResponse)
@@ -308,8 +642,10 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 # Product Routes
 @api_router.get("/products", response_model=List[Product])
 async def get_products(
+    request: Request,
     active_only: bool = True,
     category: Optional[str] = None,
+    category_id: Optional[str] = None,
     type: Optional[str] = None,
     featured: Optional[bool] = None
 ):
@@ -318,20 +654,26 @@ async def get_products(
         query['active'] = True
     if category:
         query['category'] = category
+    if category_id:
+        query['category_id'] = category_id
     if type:
         query['type'] = type
     if featured is not None:
         query['featured'] = featured
     
-    products = await db.products.find(query, {'_id': 0}).to_list(1000)
-    
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-        if isinstance(product.get('updated_at'), str):
-            product['updated_at'] = datetime.fromisoformat(product['updated_at'])
+    async def load_products():
+        products = await db.products.find(query, {'_id': 0}).to_list(1000)
+        
+        for product in products:
+            if isinstance(product.get('created_at'), str):
+                product['created_at'] = datetime.fromisoformat(product['created_at'])
+            if isinstance(product.get('updated_at'), str):
+                product['updated_at'] = datetime.fromisoformat(product['updated_at'])
+        
+        return [Product(**product) for product in products]
     
-    return products
+    key = ('products', active_only, category, category_id, type, featured)
+    return await catalog_snapshots.serve(db, request, key, load_products)
 
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
@@ -351,12 +693,16 @@ async def create_product(
     product_data: ProductCreate,
     current_user: dict = Depends(get_current_user)
 ):
-    product = Product(**product_data.model_dump())
+    category = await resolve_category(product_data.category_id, product_data.category)
+    product = Product(**{**product_data.model_dump(), 'category_id': category['id'], 'category': category['name_pt']})
     doc = product.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     
-    await db.products.insert_one(doc)
+    async with catalog_snapshots.write(db) as catalog_version:
+        doc['catalog_version'] = catalog_version
+        await db.products.insert_one(doc)
+        await adjust_category_counts(None, doc, catalog_version)
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
@@ -370,9 +716,28 @@ async def update_product(
         raise HTTPException(status_code=404, detail="Product not found")
     
     update_data = {k: v for k, v in product_data.model_dump().items() if v is not None}
+    if 'category_id' in update_data or 'category' in update_data:
+        category = await resolve_category(update_data.get('category_id'), update_data.get('category'))
+        update_data['category_id'] = category['id']
+        update_data['category'] = category['name_pt']
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
-    await db.products.update_one({'id': product_id}, {'$set': update_data})
+    async with catalog_snapshots.write(db) as catalog_version:
+        update_data['catalog_version'] = catalog_version
+        # The pre-update state from the same atomic write keeps the counts exact under concurrent edits
+        before = await db.products.find_one_and_update(
+            {'id': product_id},
+            {'$set': update_data},
+            projection={'_id': 0, 'category_id': 1, 'active': 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        after = {
+            'category_id': update_data.get('category_id', before.get('category_id')),
+            'active': update_data.get('active', before.get('active'))
+        }
+        await adjust_category_counts(before, after, catalog_version)
     
     updated_product = await db.products.find_one({'id': product_id}, {'_id': 0})
     if isinstance(updated_product.get('created_at'), str):
@@ -387,9 +752,12 @@ async def delete_product(
     product_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    result = await db.products.delete_one({'id': product_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Product not found")
+    async with catalog_snapshots.write(db) as catalog_version:
+        deleted = await db.products.find_one_and_delete({'id': product_id}, projection={'_id': 0, 'category_id': 1, 'active': 1})
+        if deleted is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        await record_tombstone('product', product_id, catalog_version)
+        await adjust_category_counts(deleted, None, catalog_version)
     return {"message": "Product deleted successfully"}
 
 @api_router.post("/products/upload-image", response_model=ImageUploadResponse)
@@ -408,16 +776,19 @@ async def upload_image(
     return ImageUploadResponse(image_url=image_url)
 
 @api_router.get("/categories")
-async def get_categories():
-    categories = await db.categories.find({}, {'_id': 0}).to_list(1000)
-    
-    for category in categories:
-        if isinstance(category.get('created_at'), str):
-            category['created_at'] = datetime.fromisoformat(category['created_at'])
-        if isinstance(category.get('updated_at'), str):
-            category['updated_at'] = datetime.fromisoformat(category['updated_at'])
+async def get_categories(request: Request):
+    async def load_categories():
+        categories = await db.categories.find({}, {'_id': 0, 'catalog_version': 0}).to_list(1000)
+        
+        for category in categories:
+            if isinstance(category.get('created_at'), str):
+                category['created_at'] = datetime.fromisoformat(category['created_at'])
+            if isinstance(category.get('updated_at'), str):
+                category['updated_at'] = datetime.fromisoformat(category['updated_at'])
+        
+        return categories
     
-    return categories
+    return await catalog_snapshots.serve(db, request, ('categories',), load_categories)
 
 @api_router.post("/categories", response_model=Category)
 async def create_category(
@@ -441,7 +812,9 @@ async def create_category(
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     
-    await db.categories.insert_one(doc)
+    async with catalog_snapshots.write(db) as catalog_version:
+        doc['catalog_version'] = catalog_version
+        await db.categories.insert_one(doc)
     return category
 
 @api_router.get("/categories/{category_id}", response_model=Category)
@@ -470,7 +843,15 @@ async def update_category(
     update_data = {k: v for k, v in category_data.model_dump().items() if v is not None}
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
-    await db.categories.update_one({'id': category_id}, {'$set': update_data})
+    async with catalog_snapshots.write(db) as catalog_version:
+        update_data['catalog_version'] = catalog_version
+        await db.categories.update_one({'id': category_id}, {'$set': update_data})
+        if 'name_pt' in update_data and update_data['name_pt'] != existing.get('name_pt'):
+            # Keep the denormalized name on products in step with the category
+            await db.products.update_many(
+                {'category_id': category_id},
+                {'$set': {'category': update_data['name_pt'], 'catalog_version': catalog_version}}
+            )
     
     updated_category = await db.categories.find_one({'id': category_id}, {'_id': 0})
     if isinstance(updated_category.get('created_at'), str):
@@ -485,59 +866,152 @@ async def delete_category(
     category_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    # Check if any products use this category
-    category = await db.categories.find_one({'id': category_id}, {'_id': 0})
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    # Get the category name to check products
-    category_name_pt = category.get('name_pt')
-    products_using_category = await db.products.count_documents({'category': category_name_pt})
-    
-    if products_using_category > 0:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Cannot delete category. {products_using_category} product(s) are using this category."
-        )
-    
-    result = await db.categories.delete_one({'id': category_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Category not found")
+    async with catalog_snapshots.write(db) as catalog_version:
+        # Only delete while no product uses this category; the count is maintained on product writes
+        result = await db.categories.delete_one({'id': category_id, 'product_count': {'$lte': 0}})
+        if result.deleted_count == 0:
+            category = await db.categories.find_one({'id': category_id}, {'_id': 0, 'product_count': 1})
+            if not category:
+                raise HTTPException(status_code=404, detail="Category not found")
+            products_using_category = category.get('product_count', 0)
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Cannot delete category. {products_using_category} product(s) are using this category."
+            )
+        await record_tombstone('category', category_id, catalog_version)
     
     return {"message": "Category deleted successfully"}
 
+# Catalog bundle
+@api_router.get("/catalog")
+async def get_catalog(request: Request, since: Optional[int] = None):
+    """Categories, active products and settings in one response, or only what changed after ``since``"""
+    version = await catalog_snapshots.current_version(db)
+    if since is not None and not 0 <= since <= version:
+        # Unknown versions get the full catalog; share its snapshot instead of building one per value
+        since = None
+    
+    async def load_catalog():
+        settings = await load_settings()
+        
+        if since is None:
+            products = await db.products.find({'active': True}, {'_id': 0}).to_list(1000)
+            categories = await db.categories.find({}, {'_id': 0, 'catalog_version': 0}).to_list(1000)
+            bundle = {'version': version, 'full': True}
+        else:
+            # ``since`` is a published version: every write stamped with it or earlier has finished
+            changed = {'catalog_version': {'$gt': since}}
+            products = await db.products.find(changed, {'_id': 0}).to_list(None)
+            categories = await db.categories.find(changed, {'_id': 0, 'catalog_version': 0}).to_list(None)
+            tombstones = await db[CATALOG_TOMBSTONES_COLLECTION].find(changed, {'_id': 0}).to_list(None)
+            
+            # Deactivated products leave the guest catalog just like deleted ones
+            deleted_products = [p['id'] for p in products if not p.get('active')]
+            deleted_products += [t['id'] for t in tombstones if t['kind'] == 'product']
+            products = [p for p in products if p.get('active')]
+            bundle = {
+                'version': version,
+                'full': False,
+                'since': since,
+                'deleted_products': deleted_products,
+                'deleted_categories': [t['id'] for t in tombstones if t['kind'] == 'category']
+            }
+        
+        for category in categories:
+            if isinstance(category.get('created_at'), str):
+                category['created_at'] = datetime.fromisoformat(category['created_at'])
+            if isinstance(category.get('updated_at'), str):
+                category['updated_at'] = datetime.fromisoformat(category['updated_at'])
+        
+        for product in products:
+            if isinstance(product.get('created_at'), str):
+                product['created_at'] = datetime.fromisoformat(product['created_at'])
+            if isinstance(product.get('updated_at'), str):
+                product['updated_at'] = datetime.fromisoformat(product['updated_at'])
+        
+        bundle['categories'] = categories
+        bundle['products'] = [Product(**product) for product in products]
+        bundle['settings'] = settings
+        return bundle
+    
+    key = ('catalog', None) if since is None else ('catalog', since, version)
+    return await catalog_snapshots.serve(db, request, key, load_catalog)
+
 # Order Routes
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate):
+async def create_order(
+    order_data: OrderCreate,
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Place an order; retries sending the same ``Idempotency-Key`` get the original order back"""
+    claim = None
+    if idempotency_key:
+        claim, stored = await idempotency_store.begin(
+            db, 'POST /api/orders', idempotency_key, order_data.model_dump(mode='json')
+        )
+        if stored is not None:
+            return JSONResponse(
+                status_code=stored['status_code'],
+                content=stored['body'],
+                headers={'Idempotent-Replayed': 'true'}
+            )
+    
     order = Order(**order_data.model_dump())
     doc = order.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     
-    await db.orders.insert_one(doc)
+    try:
+        await db.orders.insert_one(doc)
+    except Exception:
+        if claim:
+            await idempotency_store.release(db, claim)
+        raise
+    # Settle the key as soon as the order exists, so no retry can place it twice
+    if claim:
+        await idempotency_store.complete(db, claim, 200, order.model_dump(mode='json'))
     
     # Track analytics for ordered items
+    analytics_docs = []
     for item in order_data.items:
         analytics = ProductAnalytics(
             product_id=item.product_id,
             event_type='order'
         )
-        analytics_doc = analytics.model_dump()
-        analytics_doc['timestamp'] = analytics_doc['timestamp'].isoformat()
-        await db.analytics.insert_one(analytics_doc)
+        unique_counter.add(item.product_id, 'order', order_data.session_id, analytics.timestamp)
+        # Native datetime: rollups and expiry select events by date range
+        analytics_docs.append(analytics.model_dump())
+    if analytics_docs:
+        await db.analytics.insert_many(analytics_docs)
     
     return order
 
-@api_router.get("/orders", response_model=List[Order])
-async def get_orders(
+async def load_orders(
     status: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 1000
 ):
+    """Newest orders first, archived ones included when the range reaches them"""
     query = {}
     if status:
         query['status'] = status
-    
-    orders = await db.orders.find(query, {'_id': 0}).sort('created_at', -1).to_list(1000)
+    if start_date or end_date:
+        query['created_at'] = {}
+        if start_date:
+            query['created_at']['$gte'] = iso_utc(start_date)
+        if end_date:
+            query['created_at']['$lte'] = iso_utc(end_date)
+    
+    orders = await db.orders.find(query, {'_id': 0}).sort('created_at', -1).to_list(limit)
+    
+    # Archived orders are only read when the requested range reaches past the archive cutoff
+    reaches_archive = start_date is None and end_date is not None
+    if start_date is not None:
+        reaches_archive = iso_utc(start_date) < order_archiver.cutoff().isoformat()
+    if reaches_archive:
+        archived = await db[ARCHIVE_COLLECTION].find(query, ARCHIVE_PROJECTION).sort('created_at', -1).to_list(limit)
+        orders = sorted(orders + archived, key=lambda o: o.get('created_at', ''), reverse=True)[:limit]
     
     for order in orders:
         if isinstance(order.get('created_at'), str):
@@ -547,12 +1021,21 @@ async def get_orders(
     
     return orders
 
+@api_router.get("/orders", response_model=List[Order])
+async def get_orders(
+    status: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    return await load_orders(status, start_date, end_date)
+
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(
     order_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    order = await db.orders.find_one({'id': order_id}, {'_id': 0})
+    order, _ = await find_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -569,9 +1052,11 @@ async def update_order_status(
     status_update: OrderStatusUpdate,
     current_user: dict = Depends(get_current_user)
 ):
-    existing = await db.orders.find_one({'id': order_id}, {'_id': 0})
+    existing, archived = await find_order(order_id)
     if not existing:
         raise HTTPException(status_code=404, detail="Order not found")
+    if archived:
+        raise HTTPException(status_code=409, detail="Archived orders cannot be changed")
     
     update_data = {
         'status': status_update.status,
@@ -594,12 +1079,16 @@ async def delete_order(
     current_user: dict = Depends(get_current_user)
 ):
     # Get the order first to get product IDs
-    order = await db.orders.find_one({'id': order_id}, {'_id': 0})
+    order, archived = await find_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Delete the order
-    await db.orders.delete_one({'id': order_id})
+    if archived:
+        await delete_archived_order(db, order_id)
+    else:
+        await db.orders.delete_one({'id': order_id})
+        await discard_archive_copy(db, order_id)
     
     # Delete associated analytics entries
     # Get the order timestamp to find related analytics
@@ -613,15 +1102,17 @@ async def delete_order(
     
     if product_ids and order_timestamp:
         # Delete analytics within 10 minutes of order creation (to catch add_to_cart events too)
-        time_window_start = (order_timestamp - timedelta(minutes=10)).isoformat()
-        time_window_end = (order_timestamp + timedelta(minutes=5)).isoformat()
+        time_window_start = order_timestamp - timedelta(minutes=10)
+        time_window_end = order_timestamp + timedelta(minutes=5)
         
-        # Delete both order and add_to_cart events
-        delete_result = await db.analytics.delete_many({
+        # Delete both order and add_to_cart events, also from the daily rollups
+        order_events = {
             'product_id': {'$in': product_ids},
             'event_type': {'$in': ['order', 'add_to_cart']},
             'timestamp': {'$gte': time_window_start, '$lte': time_window_end}
-        })
+        }
+        await analytics_retention.discount(db, order_events)
+        delete_result = await db.analytics.delete_many(order_events)
         
         return {
             "message": "Order deleted successfully",
@@ -634,38 +1125,39 @@ async def delete_order(
 @api_router.post("/analytics/track")
 async def track_analytics(event: AnalyticsEvent):
     analytics = ProductAnalytics(**event.model_dump())
+    unique_counter.add(event.product_id, event.event_type, event.session_id, analytics.timestamp)
     doc = analytics.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
+    
+    if event.event_type == 'view' and ANALYTICS_VIEW_SAMPLE_RATE < 1:
+        # Store a random sample of views, each standing in for 1/rate of them
+        if random.random() >= ANALYTICS_VIEW_SAMPLE_RATE:
+            return {"message": "Event tracked"}
+        doc['weight'] = 1 / ANALYTICS_VIEW_SAMPLE_RATE
     
     await db.analytics.insert_one(doc)
     return {"message": "Event tracked"}
 
-@api_router.get("/analytics/products")
-async def get_product_analytics(current_user: dict = Depends(get_current_user)):
-    # Get all products
-    products = await db.products.find({}, {'_id': 0}).to_list(1000)
+def find_all_products():
+    return db.products.find({}, {'_id': 0}).to_list(1000)
+
+async def load_product_analytics(days: int = 30, products=None):
+    """Event totals, distinct viewers and buyers per product over the last ``days`` UTC days"""
+    # Same window as the unique counts: today and the ``days - 1`` days before it
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    # All products (or a pending read of them); views, add to cart and orders from the
+    # daily rollups plus the raw events not rolled up yet
+    products, counts, sketches = await asyncio.gather(
+        products if products is not None else find_all_products(),
+        analytics_retention.event_counts(db, first_day=first_day),
+        unique_counter.load(db, days)
+    )
     
     analytics_data = []
     for product in products:
         product_id = product['id']
-        
-        # Count views
-        views = await db.analytics.count_documents({
-            'product_id': product_id,
-            'event_type': 'view'
-        })
-        
-        # Count add to cart
-        add_to_cart = await db.analytics.count_documents({
-            'product_id': product_id,
-            'event_type': 'add_to_cart'
-        })
-        
-        # Count orders
-        orders = await db.analytics.count_documents({
-            'product_id': product_id,
-            'event_type': 'order'
-        })
+        views = counts.get((product_id, 'view'), 0)
+        add_to_cart = counts.get((product_id, 'add_to_cart'), 0)
+        orders = counts.get((product_id, 'order'), 0)
         
         # Calculate conversion rate
         conversion_rate = (orders / views * 100) if views > 0 else 0
@@ -673,6 +1165,10 @@ async def get_product_analytics(current_user: dict = Depends(get_current_user)):
         # Calculate revenue
         revenue = orders * product['price']
         
+        unique_viewers = sketches[(product_id, 'view')].count() if (product_id, 'view') in sketches else 0
+        unique_buyers = sketches[(product_id, 'order')].count() if (product_id, 'order') in sketches else 0
+        unique_conversion_rate = (unique_buyers / unique_viewers * 100) if unique_viewers > 0 else 0
+        
         analytics_data.append({
             'product_id': product_id,
             'name_pt': product['name_pt'],
@@ -684,6 +1180,9 @@ async def get_product_analytics(current_user: dict = Depends(get_current_user)):
             'add_to_cart': add_to_cart,
             'orders': orders,
             'conversion_rate': round(conversion_rate, 2),
+            'unique_viewers': unique_viewers,
+            'unique_buyers': unique_buyers,
+            'unique_conversion_rate': round(unique_conversion_rate, 2),
             'revenue': revenue
         })
     
@@ -692,37 +1191,48 @@ async def get_product_analytics(current_user: dict = Depends(get_current_user)):
     
     return analytics_data
 
-@api_router.get("/analytics/summary")
-async def get_analytics_summary(current_user: dict = Depends(get_current_user)):
-    # Total orders
-    total_orders = await db.orders.count_documents({})
-    
-    # Pending orders
-    pending_orders = await db.orders.count_documents({'status': 'pending'})
-    
-    # Completed orders
-    completed_orders = await db.orders.count_documents({'status': 'completed'})
-    
-    # Total revenue from completed orders
-    completed_orders_data = await db.orders.find({'status': 'completed'}, {'_id': 0}).to_list(1000)
-    total_revenue = sum(order.get('total', 0) for order in completed_orders_data)
-    
-    # Recent orders (last 7 days)
-    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    seven_days_ago_iso = seven_days_ago.isoformat()
-    recent_orders = await db.orders.count_documents({
-        'created_at': {'$gte': seven_days_ago_iso}
-    })
+@api_router.get("/analytics/products")
+async def get_product_analytics(
+    days: int = Query(30, ge=1),
+    current_user: dict = Depends(get_current_user)
+):
+    return await load_product_analytics(days)
+
+async def count_recent_orders(since: datetime):
+    recent_orders = await db.orders.count_documents({'created_at': {'$gte': since.isoformat()}})
+    if order_archiver.cutoff() > since:
+        recent_orders += await db[ARCHIVE_COLLECTION].count_documents({'created_at': {'$gte': since.isoformat()}})
+    return recent_orders
+
+async def load_analytics_summary():
+    # Order counts and revenue per status, the running totals of archived orders,
+    # orders of the last 7 days and order events per product are independent reads
+    status_rows, archived, recent_orders, ordered_products = await asyncio.gather(
+        db.orders.aggregate([
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'revenue': {'$sum': '$total'}}}
+        ]).to_list(None),
+        archived_totals(db),
+        count_recent_orders(datetime.now(timezone.utc) - timedelta(days=7)),
+        analytics_retention.event_counts(db, 'order')
+    )
+    by_status = {row['_id']: row for row in status_rows}
+    total_orders = sum(row['count'] for row in status_rows) + sum(row.get('count', 0) for row in archived.values())
+    pending_orders = by_status.get('pending', {}).get('count', 0)
+    completed_orders = by_status.get('completed', {}).get('count', 0) + archived.get('completed', {}).get('count', 0)
+    total_revenue = by_status.get('completed', {}).get('revenue', 0) + archived.get('completed', {}).get('revenue', 0)
     
     # Most popular categories
-    category_stats = {}
-    analytics_events = await db.analytics.find({'event_type': 'order'}, {'_id': 0}).to_list(10000)
+    products = await db.products.find(
+        {'id': {'$in': [product_id for product_id, _ in ordered_products]}},
+        {'_id': 0, 'id': 1, 'category': 1}
+    ).to_list(None)
+    product_categories = {product['id']: product['category'] for product in products}
     
-    for event in analytics_events:
-        product = await db.products.find_one({'id': event['product_id']}, {'_id': 0})
-        if product:
-            category = product['category']
-            category_stats[category] = category_stats.get(category, 0) + 1
+    category_stats = {}
+    for (product_id, _), count in ordered_products.items():
+        category = product_categories.get(product_id)
+        if category:
+            category_stats[category] = category_stats.get(category, 0) + count
     
     popular_categories = sorted(category_stats.items(), key=lambda x: x[1], reverse=True)[:5]
     
@@ -735,31 +1245,226 @@ async def get_analytics_summary(current_user: dict = Depends(get_current_user)):
         'popular_categories': [{'category': cat, 'count': count} for cat, count in popular_categories]
     }
 
+@api_router.get("/analytics/summary")
+async def get_analytics_summary(current_user: dict = Depends(get_current_user)):
+    return await load_analytics_summary()
+
 @api_router.delete("/analytics/reset")
 async def reset_analytics(current_user: dict = Depends(get_current_user)):
     """Delete all analytics data"""
     result = await db.analytics.delete_many({})
+    await unique_counter.reset(db)
+    await analytics_retention.reset(db)
     return {
         "message": "Analytics data reset successfully",
         "deleted_count": result.deleted_count
     }
 
+# Admin diagnostics
+@api_router.get("/admin/profile")
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    format: ProfileFormat = ProfileFormat.collapsed,
+    all_threads: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Sample the stacks of the worker serving this request for ``seconds``"""
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    if sampling_profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already being captured on this worker")
+    
+    # This handler runs on the event loop thread, which is the one to watch
+    thread_id = None if all_threads else threading.get_ident()
+    try:
+        profile = await sampling_profiler.capture(seconds, interval_ms / 1000, thread_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    logging.info(f"Captured a {profile.duration_ms:.0f} ms profile for {current_user['email']}")
+    if format == ProfileFormat.speedscope:
+        filename = f"teruza-{os.getpid()}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.speedscope.json"
+        return JSONResponse(
+            content=profile.speedscope(name=f"teruza worker {os.getpid()}"),
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+    return PlainTextResponse(profile.collapsed())
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = 100,
+    collection: Optional[str] = None,
+    route: Optional[str] = None,
+    min_duration_ms: Optional[float] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = {}
+    if collection:
+        query['collection'] = collection
+    if route:
+        query['route'] = route
+    if min_duration_ms is not None:
+        query['duration_ms'] = {'$gte': min_duration_ms}
+    
+    entries = await db[SLOW_QUERIES_COLLECTION].find(query, {'_id': 0}).sort('timestamp', -1).to_list(min(limit, 1000))
+    return entries
+
+@api_router.post("/admin/orders/archive")
+async def archive_orders(current_user: dict = Depends(get_current_user)):
+    """Run an archiving pass now instead of waiting for the next scheduled one"""
+    archived = await order_archiver.run_once(db)
+    return {"archived": archived, "cutoff": order_archiver.cutoff()}
+
+@api_router.post("/admin/analytics/retention")
+async def run_analytics_retention(
+    dry_run: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Roll up completed days now; with ``dry_run`` only report what would be rolled up and expired"""
+    return await analytics_retention.run_once(db, dry_run=dry_run)
+
+# Admin dashboard
+DASHBOARD_SECTIONS = ('summary', 'product_analytics', 'products', 'orders')
+
+async def load_product_list(products):
+    products = await products
+    for product in products:
+        if isinstance(product.get('created_at'), str):
+            product['created_at'] = datetime.fromisoformat(product['created_at'])
+        if isinstance(product.get('updated_at'), str):
+            product['updated_at'] = datetime.fromisoformat(product['updated_at'])
+    return [Product(**product) for product in products]
+
+@api_router.get("/admin/dashboard")
+async def get_admin_dashboard(
+    sections: Optional[str] = None,
+    days: int = Query(30, ge=1),
+    order_status: Optional[str] = None,
+    orders_limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """What the admin pages show, in one authenticated call; sections load concurrently"""
+    requested = DASHBOARD_SECTIONS
+    if sections:
+        requested = tuple(dict.fromkeys(name.strip() for name in sections.split(',') if name.strip()))
+        unknown = [name for name in requested if name not in DASHBOARD_SECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown dashboard section(s): {', '.join(unknown)}")
+    
+    # The product list and the product analytics share one read of the products
+    products = None
+    if 'products' in requested or 'product_analytics' in requested:
+        products = asyncio.ensure_future(find_all_products())
+    loaders = {
+        'summary': lambda: load_analytics_summary(),
+        'product_analytics': lambda: load_product_analytics(days, products),
+        'products': lambda: load_product_list(products),
+        'orders': lambda: load_orders(order_status, limit=min(orders_limit, 1000)),
+    }
+    
+    payload = {}
+    timings = {}
+    errors = {}
+    
+    async def run_section(name):
+        start = time.perf_counter()
+        try:
+            payload[name] = await loaders[name]()
+        except Exception:
+            # One failing section should not take the rest of the dashboard down
+            logging.exception(f"Dashboard section {name} failed")
+            payload[name] = None
+            errors[name] = "Failed to load"
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(run_section(name) for name in requested))
+    timings['total'] = round((time.perf_counter() - start) * 1000, 2)
+    
+    return {**payload, 'timings_ms': timings, 'errors': errors}
+
+# Export Routes
+def export_response(documents, fmt, columns, to_row, name):
+    filename = f"{name}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{fmt.value}"
+    return StreamingResponse(
+        stream_export(documents, fmt.value, columns, to_row),
+        media_type=MEDIA_TYPES[fmt.value],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/admin/export/orders")
+async def export_orders(
+    format: ExportFormat = ExportFormat.csv,
+    status: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream every matching order, oldest first, archived ones included"""
+    query = {}
+    if status:
+        query['status'] = status
+    if start_date or end_date:
+        query['created_at'] = {}
+        if start_date:
+            query['created_at']['$gte'] = iso_utc(start_date)
+        if end_date:
+            query['created_at']['$lte'] = iso_utc(end_date)
+    
+    def orders_from(collection, projection={'_id': 0}):
+        return db[collection].find(query, projection).sort('created_at', 1).batch_size(EXPORT_BATCH_SIZE)
+    
+    orders = orders_from('orders')
+    if start_date is None or iso_utc(start_date) < order_archiver.cutoff().isoformat():
+        orders = merge_sorted(orders_from(ARCHIVE_COLLECTION, ARCHIVE_PROJECTION), orders, key=lambda o: o.get('created_at', ''))
+    
+    return export_response(orders, format, ORDER_COLUMNS, order_row, 'orders')
+
+@api_router.get("/admin/export/analytics")
+async def export_analytics(
+    format: ExportFormat = ExportFormat.csv,
+    event_type: Optional[str] = None,
+    product_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream raw analytics events, oldest first; events past retention are only in the daily rollups"""
+    query = {}
+    if event_type:
+        query['event_type'] = event_type
+    if product_id:
+        query['product_id'] = product_id
+    if start_date or end_date:
+        query['timestamp'] = {}
+        if start_date:
+            query['timestamp']['$gte'] = as_utc(start_date)
+        if end_date:
+            query['timestamp']['$lte'] = as_utc(end_date)
+    
+    events = db.analytics.find(query, {'_id': 0}).sort('timestamp', 1).batch_size(EXPORT_BATCH_SIZE)
+    return export_response(events, format, ANALYTICS_COLUMNS, analytics_row, 'analytics')
+
 # Settings Routes
-@api_router.get("/settings")
-async def get_settings():
+async def load_settings():
     settings = await db.settings.find_one({}, {'_id': 0})
     if not settings:
         # Create default if not exists
-        settings = Settings(whatsapp_number='5521988760870')
-        doc = settings.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.settings.insert_one(doc)
+        await init_default_settings()
+        settings = await db.settings.find_one({}, {'_id': 0})
     
     if isinstance(settings.get('updated_at'), str):
         settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
     
     return settings
 
+@api_router.get("/settings")
+async def get_settings():
+    return await load_settings()
+
 @api_router.put("/settings", response_model=Settings)
 async def update_settings(
     settings_data: SettingsUpdate,
@@ -772,15 +1477,17 @@ async def update_settings(
         'updated_at': datetime.now(timezone.utc).isoformat()
     }
     
-    if existing:
-        await db.settings.update_one({'id': existing['id']}, {'$set': update_data})
-        updated_settings = await db.settings.find_one({'id': existing['id']}, {'_id': 0})
-    else:
-        settings = Settings(**settings_data.model_dump())
-        doc = settings.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.settings.insert_one(doc)
-        updated_settings = doc
+    # Settings are part of the /catalog bundle
+    async with catalog_snapshots.write(db):
+        if existing:
+            await db.settings.update_one({'id': existing['id']}, {'$set': update_data})
+            updated_settings = await db.settings.find_one({'id': existing['id']}, {'_id': 0})
+        else:
+            settings = Settings(**settings_data.model_dump())
+            doc = settings.model_dump()
+            doc['updated_at'] = doc['updated_at'].isoformat()
+            await db.settings.insert_one(doc)
+            updated_settings = doc
     
     if isinstance(updated_settings.get('updated_at'), str):
         updated_settings['updated_at'] = datetime.fromisoformat(updated_settings['updated_at'])
@@ -790,6 +1497,46 @@ async def update_settings(
 # Include router
 app.include_router(api_router)
 
+# Probes: liveness only needs the process; readiness needs Mongo and seed data
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    checks = {}
+    try:
+        await asyncio.wait_for(db.ping(), timeout=2)
+        checks['mongo'] = 'ok'
+        checks['seed'] = 'ok' if await is_seed_complete() else 'pending'
+    except Exception as e:
+        checks['mongo'] = f"error: {e.__class__.__name__}"
+        checks['seed'] = 'unknown'
+    
+    ready = all(value == 'ok' for value in checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={'status': 'ready' if ready else 'not ready', 'checks': checks}
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    session_limiter=session_rate_limiter,
+    shedder=load_shedder,
+    shed_routes=os.environ['SHED_ROUTES'].split(',') if 'SHED_ROUTES' in os.environ else None,
+    forwarded_hops=int(os.environ.get('FORWARDED_HOPS', 0)),
+)
+app.add_middleware(PrometheusMiddleware)
+app.add_middleware(
+    RequestContextMiddleware,
+    expose_db_headers=os.environ.get('APP_ENV', 'production') != 'production',
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -806,11 +1553,21 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_admin_user()
-    await init_default_categories()
-    await init_default_settings()
+    await ensure_indexes()
+    await seed_defaults()
+    await slow_query_log.start(db)
+    await load_shedder.start()
+    await loop_stall_monitor.start(app.routes)
+    await unique_counter.start(db)
+    await order_archiver.start(db)
+    await analytics_retention.start(db)
     logger.info("Application started")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await load_shedder.stop()
+    await loop_stall_monitor.stop()
+    await order_archiver.stop()
+    await analytics_retention.stop()
+    await unique_counter.stop()
+    db.close()
\ No newline at end of file
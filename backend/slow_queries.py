@@ -0,0 +1,211 @@
+"""Slow MongoDB operation log with automatic explain plans.
+
+``SlowQueryLog`` is a pymongo command listener. Any application command that
+takes longer than ``SLOW_QUERY_MS`` is logged with the route that issued it
+and the shape of its filter (every value replaced by ``"?"``). The first
+occurrence of each shape per ``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds is also
+re-run through ``explain`` so the entry records the winning plan stages and
+documents examined vs returned. Entries are kept in the capped
+``slow_queries`` collection, which the admin API exposes.
+"""
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+from request_context import current_route
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERIES_COLLECTION = 'slow_queries'
+
+# Commands worth explaining and where their filter lives in the command document
+FILTER_FIELDS = {
+    'find': lambda cmd: cmd.get('filter', {}),
+    'count': lambda cmd: cmd.get('query', {}),
+    'distinct': lambda cmd: cmd.get('query', {}),
+    'findAndModify': lambda cmd: cmd.get('query', {}),
+    'delete': lambda cmd: (cmd.get('deletes') or [{}])[0].get('q', {}),
+    'update': lambda cmd: (cmd.get('updates') or [{}])[0].get('q', {}),
+    'aggregate': lambda cmd: cmd.get('pipeline', []),
+}
+
+
+def _pick(document, *keys):
+    return {key: document[key] for key in keys if key in document}
+
+
+# The parts of each command that explain needs, without documents being written.
+# Explain never writes, so updates run with an empty replacement and
+# findAndModify as a remove: the query plan is the same.
+EXPLAIN_FIELDS = {
+    'find': lambda cmd: _pick(cmd, 'find', 'filter', 'sort', 'projection', 'hint', 'skip', 'limit', 'collation'),
+    'count': lambda cmd: _pick(cmd, 'count', 'query', 'hint', 'skip', 'limit', 'collation'),
+    'distinct': lambda cmd: _pick(cmd, 'distinct', 'key', 'query', 'collation'),
+    'findAndModify': lambda cmd: {**_pick(cmd, 'findAndModify', 'query', 'sort', 'hint', 'collation'), 'remove': True},
+    'delete': lambda cmd: {
+        'delete': cmd['delete'],
+        'deletes': [_pick((cmd.get('deletes') or [{}])[0], 'q', 'limit', 'hint', 'collation')],
+    },
+    'update': lambda cmd: {
+        'update': cmd['update'],
+        'updates': [{**_pick((cmd.get('updates') or [{}])[0], 'q', 'multi', 'upsert', 'hint', 'collation'), 'u': {}}],
+    },
+    'aggregate': lambda cmd: _pick(cmd, 'aggregate', 'pipeline', 'cursor', 'hint', 'collation'),
+}
+
+
+def redact(value):
+    """Replace every literal in a filter with "?" while keeping its structure
+
+    Lists of documents (``$or`` branches, pipeline stages) keep every element;
+    lists of literals such as ``$in`` values collapse to ``["?"]``.
+    """
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if any(isinstance(v, (dict, list, tuple)) for v in value):
+            return [redact(v) for v in value]
+        return ['?'] if value else []
+    return '?'
+
+
+def plan_stages(plan):
+    """Flatten a winning plan into its stage chain, e.g. ``FETCH > IXSCAN``"""
+    stages = []
+    while plan:
+        plan = plan.get('queryPlan', plan)
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        if 'inputStage' in plan:
+            plan = plan['inputStage']
+        elif plan.get('inputStages'):
+            plan = plan['inputStages'][0]
+        else:
+            plan = None
+    return ' > '.join(stages)
+
+
+def _find_key(document, key):
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        children = document.values()
+    elif isinstance(document, list):
+        children = document
+    else:
+        return None
+    for child in children:
+        found = _find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def summarize_explain(explain):
+    query_planner = _find_key(explain, 'queryPlanner') or {}
+    stats = _find_key(explain, 'executionStats') or {}
+    return {
+        'plan': plan_stages(query_planner.get('winningPlan')),
+        'docs_examined': stats.get('totalDocsExamined'),
+        'keys_examined': stats.get('totalKeysExamined'),
+        'returned': stats.get('nReturned'),
+        'execution_ms': stats.get('executionTimeMillis'),
+    }
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self, threshold_ms=100.0, explain=True, explain_interval_s=60.0,
+                 size_bytes=16 * 1024 * 1024):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval_s = explain_interval_s
+        self.size_bytes = size_bytes
+        self._db = None
+        self._loop = None
+        self._pending = {}
+        self._last_explained = {}
+        self._lock = threading.Lock()
+
+    async def start(self, db):
+        """Create the capped collection and start persisting entries"""
+        await db.create_capped_collection(SLOW_QUERIES_COLLECTION, self.size_bytes)
+        self._db = db
+        self._loop = asyncio.get_running_loop()
+
+    def _key(self, event):
+        return (event.request_id, event.connection_id, event.operation_id)
+
+    def started(self, event):
+        if event.command_name not in FILTER_FIELDS:
+            return
+        collection = event.command.get(event.command_name)
+        if collection == SLOW_QUERIES_COLLECTION:
+            return
+        # Every command passes through here; copy only what a slow one needs, not the documents it writes
+        command = copy.deepcopy(EXPLAIN_FIELDS[event.command_name](event.command))
+        with self._lock:
+            self._pending[self._key(event)] = (event.database_name, command, current_route.get())
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop(self._key(event), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms >= self.threshold_ms:
+            self._record(event.command_name, duration_ms, *pending)
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop(self._key(event), None)
+
+    def _record(self, command_name, duration_ms, database_name, command, route):
+        collection = command.get(command_name)
+        shape = redact(FILTER_FIELDS[command_name](command))
+        logger.warning(
+            f"Slow query {duration_ms:.1f}ms {command_name} {database_name}.{collection} "
+            f"route={route or '-'} filter={shape}"
+        )
+        if self._db is None or self._loop is None or self._loop.is_closed():
+            return
+
+        run_explain = False
+        if self.explain:
+            shape_key = (collection, command_name, repr(shape))
+            now = time.monotonic()
+            with self._lock:
+                if now - self._last_explained.get(shape_key, float('-inf')) >= self.explain_interval_s:
+                    self._last_explained[shape_key] = now
+                    run_explain = True
+
+        entry = {
+            'id': str(uuid.uuid4()),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'route': route,
+            'collection': collection,
+            'command': command_name,
+            'duration_ms': round(duration_ms, 2),
+            'filter_shape': shape,
+            'explain': None,
+        }
+        asyncio.run_coroutine_threadsafe(
+            self._persist(entry, command if run_explain else None), self._loop
+        )
+
+    async def _persist(self, entry, explain_command):
+        if explain_command is not None:
+            try:
+                explain = await self._db.command({'explain': explain_command, 'verbosity': 'executionStats'})
+                entry['explain'] = summarize_explain(explain)
+            except Exception as e:
+                entry['explain'] = {'error': str(e)}
+        try:
+            await self._db[SLOW_QUERIES_COLLECTION].insert_one(entry)
+        except Exception:
+            logger.exception("Failed to store slow query entry")
@@ -0,0 +1,909 @@
+"""Storage backends for the Teruza API.
+
+Handlers talk to ``db.<collection>`` using the Motor collection API. Two
+backends expose that same async interface:
+
+* ``MotorStorage`` wraps ``AsyncIOMotorClient`` and is used in production.
+* ``MemoryStorage`` keeps every collection in process memory. It supports the
+  subset of queries and update operators used by ``server.py`` and is meant
+  for tests and micro-benchmarks that must run without a MongoDB server.
+
+Select the backend with ``STORAGE_BACKEND=mongo|memory`` (default ``mongo``).
+The Motor client is tuned from the environment, see ``MONGO_CLIENT_OPTIONS``.
+
+Both backends report every operation to ``command_observers``, callables
+taking ``(collection, command_name, duration_s, succeeded)``. Motor does it
+through a pymongo command listener, the memory backend directly.
+"""
+import copy
+import functools
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+# Commands that are part of the driver's own housekeeping, not application queries
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'saslStart', 'saslContinue', 'endSessions'}
+
+
+def command_collection(command_name, command):
+    """Collection targeted by a command document, if any"""
+    if command_name == 'getMore':
+        return command.get('collection', '')
+    value = command.get(command_name)
+    return value if isinstance(value, str) else ''
+
+
+class CommandObserverListener(monitoring.CommandListener):
+    """Forwards every application command sent by the driver to observers"""
+
+    def __init__(self, observers):
+        self.observers = observers
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _key(self, event):
+        return (event.request_id, event.connection_id, event.operation_id)
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        with self._lock:
+            self._pending[self._key(event)] = command_collection(event.command_name, event.command)
+
+    def _finish(self, event, succeeded):
+        with self._lock:
+            collection = self._pending.pop(self._key(event), None)
+        if collection is None:
+            return
+        for observer in self.observers:
+            observer(collection, event.command_name, event.duration_micros / 1_000_000, succeeded)
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
+
+
+# Environment variable -> (AsyncIOMotorClient option, parser). Unset variables
+# keep the driver default. MONGO_COMPRESSORS is a comma separated preference
+# list such as "zstd,zlib"; zstd and snappy need the zstandard and
+# python-snappy packages.
+MONGO_CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGO_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGO_MAX_IDLE_TIME_MS': ('maxIdleTimeMS', int),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': ('waitQueueTimeoutMS', int),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+    'MONGO_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', int),
+    'MONGO_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', int),
+    'MONGO_COMPRESSORS': ('compressors', str),
+}
+
+
+def mongo_client_options(environ=os.environ):
+    options = {}
+    for variable, (option, parse) in MONGO_CLIENT_OPTIONS.items():
+        value = environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
+class MotorStorage:
+    """Production backend: collections are plain Motor collections"""
+
+    def __init__(self, mongo_url: str, db_name: str, command_observers=(), event_listeners=(), **client_kwargs):
+        listeners = list(event_listeners)
+        if command_observers:
+            listeners.append(CommandObserverListener(list(command_observers)))
+        if listeners:
+            client_kwargs['event_listeners'] = listeners
+        self.client = AsyncIOMotorClient(mongo_url, **client_kwargs)
+        self.database = self.client[db_name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.database[name]
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+    async def ping(self):
+        await self.client.admin.command('ping')
+
+    async def command(self, spec):
+        return await self.database.command(spec)
+
+    async def create_capped_collection(self, name, size_bytes, max_documents=None):
+        if await self.database.list_collection_names(filter={'name': name}):
+            return
+        options = {'capped': True, 'size': size_bytes}
+        if max_documents:
+            options['max'] = max_documents
+        try:
+            await self.database.create_collection(name, **options)
+        except CollectionInvalid:
+            # Another worker created it first
+            pass
+
+    def close(self):
+        self.client.close()
+
+
+# In-memory implementation
+
+_MISSING = object()
+
+
+def _get_path(doc, path):
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(doc, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _compare(value, op, operand):
+    try:
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        if op == '$lte':
+            return value <= operand
+    except TypeError:
+        # MongoDB never matches range queries across BSON types
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _candidates(value):
+    """Values a filter is tested against: arrays match on any element"""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+# $type aliases supported by the in-memory filter
+_BSON_TYPES = {'string': str, 'date': datetime, 'bool': bool, 'object': dict, 'array': list,
+               'double': float, 'int': int, 'long': int, 'number': (int, float)}
+
+
+def _match_operators(value, spec):
+    for op, operand in spec.items():
+        if op == '$exists':
+            if (value is not _MISSING) != bool(operand):
+                return False
+        elif op == '$eq':
+            if not _match_value(value, operand):
+                return False
+        elif op == '$ne':
+            if _match_value(value, operand):
+                return False
+        elif op == '$in':
+            if not any(_match_value(value, candidate) for candidate in operand):
+                return False
+        elif op == '$nin':
+            if any(_match_value(value, candidate) for candidate in operand):
+                return False
+        elif op in ('$gt', '$gte', '$lt', '$lte'):
+            if value is _MISSING or not any(_compare(v, op, operand) for v in _candidates(value)):
+                return False
+        elif op == '$regex':
+            pattern = re.compile(operand, re.IGNORECASE if 'i' in spec.get('$options', '') else 0)
+            if not any(isinstance(v, str) and pattern.search(v) for v in _candidates(value)):
+                return False
+        elif op == '$options':
+            continue
+        elif op == '$type':
+            if not isinstance(value, _BSON_TYPES[operand]):
+                return False
+        elif op == '$not':
+            if _match_operators(value, operand):
+                return False
+        else:
+            raise ValueError(f"Unsupported query operator: {op}")
+    return True
+
+
+def _match_value(value, expected):
+    if value is _MISSING:
+        return expected is None
+    return any(v == expected for v in _candidates(value))
+
+
+def _matches(doc, query):
+    for key, expected in (query or {}).items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in expected):
+                return False
+        elif key == '$and':
+            if not all(_matches(doc, sub) for sub in expected):
+                return False
+        elif key == '$nor':
+            if any(_matches(doc, sub) for sub in expected):
+                return False
+        else:
+            value = _get_path(doc, key)
+            if isinstance(expected, dict) and expected and all(k.startswith('$') for k in expected):
+                if not _match_operators(value, expected):
+                    return False
+            elif not _match_value(value, expected):
+                return False
+    return True
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    projection = dict(projection)
+    include_id = projection.pop('_id', 1)
+    included = [k for k, v in projection.items() if v]
+    if included:
+        result = {}
+        for key in included:
+            value = _get_path(doc, key)
+            if value is not _MISSING:
+                _set_path(result, key, value)
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    for key in projection:
+        _unset_path(doc, key)
+    if not include_id:
+        doc.pop('_id', None)
+    return doc
+
+
+_TYPE_ORDER = {type(None): 0, int: 1, float: 1, bool: 5, str: 2, dict: 3, list: 4, datetime: 6}
+
+
+def _sort_key(value):
+    if value is _MISSING:
+        value = None
+    if isinstance(value, ObjectId):
+        return (7, str(value))
+    return (_TYPE_ORDER.get(type(value), 8), value)
+
+
+def _pull_matches(item, condition):
+    """``$pull`` condition: a query on document elements, operators or a value on the others"""
+    if isinstance(item, dict) and isinstance(condition, dict) and not any(k.startswith('$') for k in condition):
+        return _matches(item, condition)
+    return _matches({'value': item}, {'value': condition})
+
+
+def _apply_update(doc, update, inserting=False):
+    if not any(k.startswith('$') for k in update):
+        # Replacement document
+        _id = doc.get('_id')
+        doc.clear()
+        doc.update(copy.deepcopy(update))
+        if _id is not None:
+            doc['_id'] = _id
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get_path(doc, path)
+            if op == '$set':
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == '$setOnInsert':
+                if inserting:
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif op == '$unset':
+                _unset_path(doc, path)
+            elif op == '$inc':
+                _set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == '$min':
+                if current is _MISSING or value < current:
+                    _set_path(doc, path, value)
+            elif op == '$max':
+                if current is _MISSING or value > current:
+                    _set_path(doc, path, value)
+            elif op == '$push':
+                items = [] if current is _MISSING else current
+                if isinstance(value, dict) and '$each' in value:
+                    items.extend(copy.deepcopy(value['$each']))
+                    if '$slice' in value:
+                        items = items[value['$slice']:] if value['$slice'] < 0 else items[:value['$slice']]
+                else:
+                    items.append(copy.deepcopy(value))
+                _set_path(doc, path, items)
+            elif op == '$pull':
+                if current is not _MISSING:
+                    _set_path(doc, path, [item for item in current if not _pull_matches(item, value)])
+            elif op == '$addToSet':
+                items = [] if current is _MISSING else current
+                if value not in items:
+                    items.append(copy.deepcopy(value))
+                _set_path(doc, path, items)
+            else:
+                raise ValueError(f"Unsupported update operator: {op}")
+
+
+def _upsert_seed(query):
+    """Equality fields of a filter become fields of an upserted document"""
+    seed = {}
+    for key, value in (query or {}).items():
+        if key.startswith('$'):
+            continue
+        if isinstance(value, dict) and any(k.startswith('$') for k in value):
+            if '$eq' in value:
+                _set_path(seed, key, copy.deepcopy(value['$eq']))
+            continue
+        _set_path(seed, key, copy.deepcopy(value))
+    return seed
+
+
+def _resolve(doc, expression):
+    """Evaluate an aggregation expression: "$field" paths, literals or sub-documents"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            op, args = next(iter(expression.items()))
+            if op == '$cond':
+                if isinstance(args, dict):
+                    args = [args['if'], args['then'], args['else']]
+                condition = args[0]
+                if isinstance(condition, dict) and len(condition) == 1:
+                    cond_op, cond_args = next(iter(condition.items()))
+                    left, right = (_resolve(doc, a) for a in cond_args)
+                    truthy = {'$eq': left == right, '$ne': left != right}.get(cond_op)
+                    if truthy is None:
+                        truthy = _compare(left, cond_op, right)
+                else:
+                    truthy = bool(_resolve(doc, condition))
+                return _resolve(doc, args[1] if truthy else args[2])
+            if op == '$ifNull':
+                value = _resolve(doc, args[0])
+                return _resolve(doc, args[1]) if value is None else value
+            if op in ('$eq', '$ne'):
+                left, right = (_resolve(doc, a) for a in args)
+                return (left == right) == (op == '$eq')
+            if op in ('$multiply', '$add'):
+                values = [_resolve(doc, a) or 0 for a in args]
+                return functools.reduce(lambda a, b: a * b if op == '$multiply' else a + b, values)
+        return {k: _resolve(doc, v) for k, v in expression.items()}
+    return expression
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _resolve(doc, spec['_id'])
+        group_key = repr(key)
+        if group_key not in groups:
+            groups[group_key] = {'_id': key, '__n': {}}
+        group = groups[group_key]
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            (op, expression), = accumulator.items()
+            value = _resolve(doc, expression)
+            if op == '$sum':
+                group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif op == '$avg':
+                if isinstance(value, (int, float)):
+                    group['__n'][field] = group['__n'].get(field, 0) + 1
+                    group[field] = group.get(field, 0) + value
+            elif op == '$min':
+                if value is not None and (field not in group or value < group[field]):
+                    group[field] = value
+            elif op == '$max':
+                if value is not None and (field not in group or value > group[field]):
+                    group[field] = value
+            elif op == '$first':
+                group.setdefault(field, value)
+            elif op == '$last':
+                group[field] = value
+            elif op == '$push':
+                group.setdefault(field, []).append(value)
+            elif op == '$addToSet':
+                items = group.setdefault(field, [])
+                if value not in items:
+                    items.append(value)
+            else:
+                raise ValueError(f"Unsupported accumulator: {op}")
+    results = []
+    for group in groups.values():
+        counts = group.pop('__n')
+        for field, n in counts.items():
+            group[field] = group[field] / n
+        for field, accumulator in spec.items():
+            if field != '_id' and field not in group:
+                group[field] = None if next(iter(accumulator)) != '$sum' else 0
+        results.append(group)
+    return results
+
+
+def _run_pipeline(docs, pipeline):
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == '$match':
+            docs = [doc for doc in docs if _matches(doc, spec)]
+        elif op == '$group':
+            docs = _group(docs, spec)
+        elif op == '$sort':
+            for key, direction in reversed(list(spec.items())):
+                docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+        elif op == '$skip':
+            docs = docs[spec:]
+        elif op == '$limit':
+            docs = docs[:spec]
+        elif op == '$count':
+            docs = [{spec: len(docs)}] if docs else []
+        elif op == '$unwind':
+            path = spec if isinstance(spec, str) else spec['path']
+            unwound = []
+            for doc in docs:
+                values = _get_path(doc, path[1:])
+                for value in (values if isinstance(values, list) else []):
+                    item = copy.deepcopy(doc)
+                    _set_path(item, path[1:], value)
+                    unwound.append(item)
+            docs = unwound
+        elif op == '$project':
+            if all(v in (0, False) for v in spec.values()):
+                docs = [_project(doc, spec) for doc in docs]
+            else:
+                projected = []
+                for doc in docs:
+                    item = {'_id': doc.get('_id')} if spec.get('_id', 1) else {}
+                    for field, expression in spec.items():
+                        if field == '_id' and expression in (0, 1, True, False):
+                            continue
+                        if expression in (1, True):
+                            value = _get_path(doc, field)
+                            if value is not _MISSING:
+                                _set_path(item, field, value)
+                        else:
+                            _set_path(item, field, _resolve(doc, expression))
+                    projected.append(item)
+                docs = projected
+        else:
+            raise ValueError(f"Unsupported pipeline stage: {op}")
+    return docs
+
+
+class MemoryCursor:
+    command_name = 'find'
+
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+        self._stream = None
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _evaluate(self):
+        start = time.perf_counter()
+        try:
+            return self._results_for_query()
+        finally:
+            self._collection._observe(self.command_name, time.perf_counter() - start, True)
+
+    def _documents(self):
+        """Matching documents in cursor order, not yet copied or projected"""
+        docs = [doc for doc in self._collection._docs if _matches(doc, self._query)]
+        for key, direction in reversed(self._sort):
+            docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return docs
+
+    def _results_for_query(self):
+        return [_project(doc, self._projection) for doc in self._documents()]
+
+    async def to_list(self, length=None):
+        if self._results is None:
+            self._results = self._evaluate()
+        results = self._results[:length] if length else self._results
+        self._results = self._results[len(results):]
+        return results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is not None:
+            if not self._results:
+                raise StopAsyncIteration
+            return self._results.pop(0)
+        if self._stream is None:
+            # Copy documents one at a time, like a server cursor handing out batches
+            start = time.perf_counter()
+            self._stream = iter(self._documents())
+            self._collection._observe(self.command_name, time.perf_counter() - start, True)
+        for doc in self._stream:
+            return _project(doc, self._projection)
+        raise StopAsyncIteration
+
+
+class MemoryAggregateCursor(MemoryCursor):
+    command_name = 'aggregate'
+
+    def __init__(self, collection, pipeline):
+        super().__init__(collection, None, None)
+        self._pipeline = pipeline
+
+    def _documents(self):
+        return _run_pipeline(copy.deepcopy(self._collection._docs), self._pipeline)
+
+    def _results_for_query(self):
+        return self._documents()
+
+
+def _observed(command_name):
+    """Report a collection method to the storage's command observers"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            succeeded = False
+            try:
+                result = await method(self, *args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                self._observe(command_name, time.perf_counter() - start, succeeded)
+        return wrapper
+    return decorator
+
+
+class MemoryCollection:
+    def __init__(self, name, observers=()):
+        self.name = name
+        self._observers = observers
+        self._docs = []
+        self._unique_indexes = {}
+        self._ttl_indexes = {}
+        self._max_documents = None
+
+    def _observe(self, command_name, duration_s, succeeded):
+        for observer in self._observers:
+            observer(self.name, command_name, duration_s, succeeded)
+
+    def _check_unique(self, doc, ignore=None):
+        for index_name, (keys, sparse) in self._unique_indexes.items():
+            if sparse and all(_get_path(doc, k) is _MISSING for k in keys):
+                continue
+            key = tuple(repr(_get_path(doc, k)) for k in keys)
+            for other in self._docs:
+                if other is ignore or other is doc:
+                    continue
+                if tuple(repr(_get_path(other, k)) for k in keys) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {index_name}")
+
+    @_observed('createIndexes')
+    async def create_index(self, keys, unique=False, name=None, sparse=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = name or '_'.join(f"{k}_{d}" for k, d in keys)
+        expire_after = kwargs.get('expireAfterSeconds')
+        if expire_after is not None:
+            if self._ttl_indexes.get(name, expire_after) != expire_after:
+                # Same error MongoDB gives; options of an existing index change through collMod
+                raise OperationFailure(f"An existing index has the same name as the requested index: {name}", 85)
+            self._ttl_indexes[name] = expire_after
+        if unique:
+            self._unique_indexes[name] = ([k for k, _ in keys], sparse)
+        return name
+
+    @_observed('dropIndexes')
+    async def drop_index(self, name):
+        if name not in self._unique_indexes and name not in self._ttl_indexes:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+        self._unique_indexes.pop(name, None)
+        self._ttl_indexes.pop(name, None)
+
+    @_observed('drop')
+    async def drop(self):
+        self._docs.clear()
+        self._unique_indexes.clear()
+        self._ttl_indexes.clear()
+
+    def find(self, filter=None, projection=None):
+        return MemoryCursor(self, filter, projection)
+
+    def aggregate(self, pipeline):
+        return MemoryAggregateCursor(self, pipeline)
+
+    @_observed('find')
+    async def find_one(self, filter=None, projection=None):
+        return self._find_one(filter, projection)
+
+    def _find_one(self, filter=None, projection=None):
+        for doc in self._docs:
+            if _matches(doc, filter):
+                return _project(doc, projection)
+        return None
+
+    @_observed('aggregate')
+    async def count_documents(self, filter=None):
+        return sum(1 for doc in self._docs if _matches(doc, filter))
+
+    @_observed('count')
+    async def estimated_document_count(self):
+        return len(self._docs)
+
+    @_observed('distinct')
+    async def distinct(self, key, filter=None):
+        values = []
+        for doc in self._docs:
+            if _matches(doc, filter):
+                value = _get_path(doc, key)
+                for v in (value if isinstance(value, list) else [value]):
+                    if v is not _MISSING and v not in values:
+                        values.append(v)
+        return values
+
+    def _insert(self, document):
+        if '_id' in document:
+            if any(doc['_id'] == document['_id'] for doc in self._docs):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        else:
+            document['_id'] = ObjectId()
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._docs.append(stored)
+        if self._max_documents and len(self._docs) > self._max_documents:
+            del self._docs[0]
+        return document['_id']
+
+    @_observed('insert')
+    async def insert_one(self, document):
+        return InsertOneResult(self._insert(document), True)
+
+    @_observed('insert')
+    async def insert_many(self, documents, ordered=True):
+        return InsertManyResult([self._insert(doc) for doc in documents], True)
+
+    def _update(self, filter, update, upsert, many):
+        matched = modified = 0
+        for doc in self._docs:
+            if not _matches(doc, filter):
+                continue
+            matched += 1
+            before = copy.deepcopy(doc)
+            _apply_update(doc, update)
+            try:
+                self._check_unique(doc, ignore=doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            if doc != before:
+                modified += 1
+            if not many:
+                break
+        raw = {'n': matched, 'nModified': modified, 'ok': 1.0}
+        if not matched and upsert:
+            doc = _upsert_seed(filter)
+            _apply_update(doc, update, inserting=True)
+            raw['upserted'] = self._insert(doc)
+            raw['n'] = 1
+        return UpdateResult(raw, True)
+
+    @_observed('update')
+    async def update_one(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert, many=False)
+
+    @_observed('update')
+    async def update_many(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert, many=True)
+
+    @_observed('update')
+    async def replace_one(self, filter, replacement, upsert=False):
+        return self._update(filter, replacement, upsert, many=False)
+
+    @_observed('bulkWrite')
+    async def bulk_write(self, requests, ordered=True):
+        raw = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                raw['nInserted'] += 1
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                update = request._doc
+                result = self._update(request._filter, update, request._upsert, many=isinstance(request, UpdateMany))
+                if result.upserted_id is not None:
+                    raw['nUpserted'] += 1
+                    raw['upserted'].append({'index': index, '_id': result.upserted_id})
+                else:
+                    raw['nMatched'] += result.matched_count
+                    raw['nModified'] += result.modified_count
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                raw['nRemoved'] += self._delete(request._filter, many=isinstance(request, DeleteMany))
+            else:
+                raise ValueError(f"Unsupported bulk operation: {request!r}")
+        return BulkWriteResult(raw, True)
+
+    @_observed('findAndModify')
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, sort=None):
+        matches = [doc for doc in self._docs if _matches(doc, filter)]
+        for key, direction in reversed(sort or []):
+            matches.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+        if not matches:
+            if not upsert:
+                return None
+            result = self._update(filter, update, True, many=False)
+            if return_document == ReturnDocument.BEFORE:
+                return None
+            return self._find_one({'_id': result.upserted_id}, projection)
+        target = matches[0]
+        before = _project(target, projection)
+        self._update({'_id': target['_id']}, update, False, many=False)
+        if return_document == ReturnDocument.BEFORE:
+            return before
+        return _project(target, projection)
+
+    def _delete(self, filter, many):
+        if not many:
+            for i, doc in enumerate(self._docs):
+                if _matches(doc, filter):
+                    del self._docs[i]
+                    return 1
+            return 0
+        kept = [doc for doc in self._docs if not _matches(doc, filter)]
+        deleted = len(self._docs) - len(kept)
+        self._docs[:] = kept
+        return deleted
+
+    @_observed('findAndModify')
+    async def find_one_and_delete(self, filter, projection=None, sort=None):
+        matches = [doc for doc in self._docs if _matches(doc, filter)]
+        for key, direction in reversed(sort or []):
+            matches.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+        if not matches:
+            return None
+        target = matches[0]
+        self._delete({'_id': target['_id']}, many=False)
+        return _project(target, projection)
+
+    @_observed('delete')
+    async def delete_one(self, filter):
+        return DeleteResult({'n': self._delete(filter, many=False), 'ok': 1.0}, True)
+
+    @_observed('delete')
+    async def delete_many(self, filter):
+        return DeleteResult({'n': self._delete(filter, many=True), 'ok': 1.0}, True)
+
+
+class MemoryStorage:
+    """In-process backend with the same collection interface as Motor"""
+
+    def __init__(self, command_observers=()):
+        self._collections = {}
+        self._observers = list(command_observers)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name, self._observers)
+        return self._collections[name]
+
+    async def ping(self):
+        return None
+
+    async def command(self, spec):
+        """The commands the app sends: ``ping``, ``collMod`` of a TTL index and ``explain``"""
+        name = next(iter(spec))
+        if name == 'ping':
+            return {'ok': 1.0}
+        if name == 'collMod':
+            collection = self[spec['collMod']]
+            index = spec.get('index', {})
+            if 'expireAfterSeconds' in index:
+                if index.get('name') not in collection._ttl_indexes:
+                    raise OperationFailure(f"cannot find index {index.get('name')!r} for ns {spec['collMod']}", 27)
+                collection._ttl_indexes[index['name']] = index['expireAfterSeconds']
+            return {'ok': 1.0}
+        if name == 'explain':
+            return self._explain(spec['explain'])
+        raise OperationFailure(f"no such command: '{name}'", 59)
+
+    def _explain(self, command):
+        """Collection scan plan with the documents a query would examine and return"""
+        command_name = next(iter(command))
+        collection = self[command[command_name]]
+        if command_name == 'find':
+            query = command.get('filter')
+        elif command_name in ('count', 'distinct', 'findAndModify'):
+            query = command.get('query')
+        elif command_name in ('delete', 'update'):
+            ops = command.get('deletes' if command_name == 'delete' else 'updates') or [{}]
+            query = ops[0].get('q')
+        else:
+            stages = command.get('pipeline') or [{}]
+            query = stages[0].get('$match')
+        returned = sum(1 for doc in collection._docs if _matches(doc, query))
+        return {
+            'queryPlanner': {'namespace': collection.name, 'winningPlan': {'stage': 'COLLSCAN'}},
+            'executionStats': {
+                'nReturned': returned,
+                'executionTimeMillis': 0,
+                'totalKeysExamined': 0,
+                'totalDocsExamined': len(collection._docs),
+            },
+            'ok': 1.0,
+        }
+
+    async def create_capped_collection(self, name, size_bytes, max_documents=None):
+        self[name]._max_documents = max_documents
+
+    def close(self):
+        pass
+
+
+def create_storage(command_observers=(), **client_kwargs):
+    """Build the backend selected by ``STORAGE_BACKEND``"""
+    backend = os.environ.get('STORAGE_BACKEND', 'mongo').lower()
+    if backend == 'memory':
+        return MemoryStorage(command_observers)
+    if backend == 'mongo':
+        options = {**mongo_client_options(), **client_kwargs}
+        return MotorStorage(os.environ['MONGO_URL'], os.environ['DB_NAME'], command_observers, **options)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
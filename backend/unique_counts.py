@@ -0,0 +1,182 @@
+"""Approximate distinct viewers and buyers per product with HyperLogLog.
+
+Every ``view`` or ``order`` event that carries the guest's anonymous session
+id is added to a HyperLogLog sketch for its product, event type and UTC day.
+Sketches merge by taking the register-wise maximum, so any range of days
+gives the number of distinct sessions in it (about 1.6% standard error)
+without storing one document per event.
+
+``UniqueCounter`` accumulates sketches in memory and merges them into the
+``analytics_sketches`` collection every ``ANALYTICS_SKETCH_FLUSH_S``
+seconds. Each stored sketch is a few KB at most; registers are zlib
+compressed, so the sketch of a product seen by a handful of guests is tens
+of bytes. Writes use a revision number, so concurrent flushes from several
+workers never lose each other's registers. A worker that dies loses at most
+one flush interval of uniques; raw event counts are unaffected.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SKETCHES_COLLECTION = 'analytics_sketches'
+SKETCHED_EVENTS = ('view', 'order')
+PRECISION = 12
+MAX_FLUSH_ATTEMPTS = 5
+
+
+class HyperLogLog:
+    def __init__(self, registers=None, precision=PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            self.registers = np.zeros(self.size, dtype=np.uint8)
+        else:
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other):
+        """Merge ``other`` into this sketch"""
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / np.exp2(-self.registers.astype(np.float64)).sum()
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate while most registers are still empty
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(zlib.decompress(data))
+
+
+def day_of(timestamp):
+    return timestamp.astimezone(timezone.utc).date().isoformat()
+
+
+class UniqueCounter:
+    def __init__(self, flush_interval_s=10.0):
+        self.flush_interval_s = flush_interval_s
+        self._db = None
+        self._task = None
+        self._pending = {}
+
+    async def start(self, db):
+        """Create the sketch indexes and start flushing to ``db``"""
+        await db[SKETCHES_COLLECTION].create_index(
+            [('product_id', 1), ('event_type', 1), ('day', 1)], unique=True
+        )
+        await db[SKETCHES_COLLECTION].create_index('day')
+        self._db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def add(self, product_id, event_type, session_id, timestamp):
+        if event_type not in SKETCHED_EVENTS or not session_id:
+            return
+        key = (product_id, event_type, day_of(timestamp))
+        sketch = self._pending.get(key)
+        if sketch is None:
+            sketch = self._pending[key] = HyperLogLog()
+        sketch.add(session_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush unique counters")
+
+    async def flush(self):
+        if self._db is None or not self._pending:
+            return
+        pending = list(self._pending.items())
+        self._pending = {}
+        for i, (key, sketch) in enumerate(pending):
+            try:
+                await self._merge_into_stored(key, sketch)
+            except Exception:
+                # Keep the unwritten registers for the next flush; merging twice is harmless
+                for key, sketch in pending[i:]:
+                    current = self._pending.get(key)
+                    self._pending[key] = sketch if current is None else current.update(sketch)
+                raise
+
+    async def _merge_into_stored(self, key, sketch):
+        product_id, event_type, day = key
+        query = {'product_id': product_id, 'event_type': event_type, 'day': day}
+        collection = self._db[SKETCHES_COLLECTION]
+        for _ in range(MAX_FLUSH_ATTEMPTS):
+            stored = await collection.find_one(query, {'_id': 0, 'registers': 1, 'rev': 1})
+            if stored is None:
+                try:
+                    await collection.insert_one({**query, 'registers': sketch.to_bytes(), 'rev': 1})
+                    return
+                except DuplicateKeyError:
+                    continue
+            merged = HyperLogLog.from_bytes(stored['registers']).update(sketch)
+            result = await collection.update_one(
+                {**query, 'rev': stored['rev']},
+                {'$set': {'registers': merged.to_bytes()}, '$inc': {'rev': 1}}
+            )
+            if result.modified_count:
+                return
+        raise RuntimeError(f"Sketch {key} kept changing during {MAX_FLUSH_ATTEMPTS} flush attempts")
+
+    async def reset(self, db):
+        self._pending = {}
+        result = await db[SKETCHES_COLLECTION].delete_many({})
+        return result.deleted_count
+
+    async def load(self, db, days=None):
+        """Merged sketches per ``(product_id, event_type)`` over the last ``days`` days (all when None)"""
+        query = {'event_type': {'$in': list(SKETCHED_EVENTS)}}
+        first_day = None
+        if days is not None:
+            first_day = day_of(datetime.now(timezone.utc) - timedelta(days=days - 1))
+            query['day'] = {'$gte': first_day}
+
+        merged = {}
+
+        def merge(product_id, event_type, sketch):
+            current = merged.get((product_id, event_type))
+            merged[(product_id, event_type)] = sketch if current is None else current.update(sketch)
+
+        stored = await db[SKETCHES_COLLECTION].find(
+            query, {'_id': 0, 'product_id': 1, 'event_type': 1, 'registers': 1}
+        ).to_list(None)
+        for doc in stored:
+            merge(doc['product_id'], doc['event_type'], HyperLogLog.from_bytes(doc['registers']))
+        # Include what this worker has not flushed yet
+        for (product_id, event_type, day), sketch in list(self._pending.items()):
+            if first_day is None or day >= first_day:
+                merge(product_id, event_type, HyperLogLog(sketch.registers.tobytes()))
+        return merged
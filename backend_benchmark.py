@@ -0,0 +1,489 @@
+"""In-process micro-benchmarks for the Teruza API handlers.
+
+Requests go straight into the ASGI app through ``httpx.ASGITransport`` while
+the server runs on the in-memory storage backend, so the numbers measure
+routing, validation, serialization and date parsing with network and MongoDB
+latency factored out. Each endpoint runs against a freshly seeded catalog of
+a configurable size:
+
+    python backend_benchmark.py --products 200 --analytics 5000 --iterations 300 \\
+        --output bench.json --baseline previous_bench.json
+
+``--catalog-report`` compares the catalog endpoints served from precompressed
+snapshots against plain per-request JSON rendering (``CATALOG_SNAPSHOTS=false``),
+reporting bytes on the wire and wall/CPU time per request for each encoding.
+Use ``--image-kb`` to give products inline images like uploaded ones.
+
+``--check-budgets`` instead issues each request against a small and a large
+catalog, reads the ``X-DB-Calls`` header and fails if an endpoint exceeds its
+entry in ``QUERY_BUDGETS`` or its query count grows with the data size (the
+signature of an N+1 loop). tests/test_query_budgets.py runs the same check
+under pytest.
+
+``--check-export-memory`` streams the CSV and NDJSON exports of an order and
+analytics history of at least ``EXPORT_MIN_CHUNKS`` chunks per export (the
+seed grows with ``EXPORT_CHUNK_BYTES`` when ``--orders``/``--analytics`` are
+too small) and fails if the body is buffered or the memory held by the worker
+keeps growing from chunk to chunk instead of staying flat.
+tests/test_export_memory.py runs the same check with small chunks.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["APP_ENV"] = "development"
+os.environ.setdefault("DB_NAME", "teruza_benchmark")
+os.environ["RATE_LIMITS"] = ""
+os.environ["SESSION_RATE_LIMITS"] = ""
+# The watchdog's stall reports would land in the export memory measurements
+os.environ["LOOP_STALL_MONITOR"] = "false"
+
+import exports  # noqa: E402
+import server  # noqa: E402
+from catalog_cache import CatalogSnapshots  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+from backend_load_test import EndpointStats, compare_results  # noqa: E402
+from backend_test import ADMIN_CREDENTIALS, TEST_PRODUCT  # noqa: E402
+
+
+def inline_image(size_kb):
+    """A data URI like the ones produced by /products/upload-image"""
+    # Random bytes compress about as badly as real JPEG/PNG data
+    return "data:image/jpeg;base64," + base64.b64encode(os.urandom(size_kb * 1024)).decode()
+
+
+# Maximum database round trips per request, whatever the size of the data.
+# Authenticated endpoints include the user lookup done by get_current_user;
+# catalog reads include the catalog version check made on a cold snapshot.
+QUERY_BUDGETS = {
+    "GET /products": 2,
+    "GET /products?category": 2,
+    "GET /products/{id}": 1,
+    "GET /categories": 2,
+    "GET /settings": 1,
+    "GET /catalog": 4,
+    "GET /catalog?since": 5,
+    "GET /auth/me": 1,
+    "POST /analytics/track": 1,
+    "POST /orders": 2,
+    "POST /orders+key": 5,
+    "POST /orders+key retry": 1,
+    "GET /orders": 2,
+    "GET /orders?start_date": 3,
+    "GET /analytics/summary": 8,
+    "GET /analytics/products": 6,
+    "GET /admin/dashboard": 14,
+}
+
+BUDGET_SIZES = ({"products": 5, "orders": 5, "analytics": 20},
+                {"products": 150, "orders": 300, "analytics": 3000})
+
+EXPORT_CASES = [
+    ("orders csv", "/api/admin/export/orders", "format=csv"),
+    ("orders ndjson", "/api/admin/export/orders", "format=ndjson"),
+    ("analytics csv", "/api/admin/export/analytics", "format=csv"),
+    ("analytics ndjson", "/api/admin/export/analytics", "format=ndjson"),
+]
+# Exports shorter than this many chunks cannot tell streaming from buffering
+EXPORT_MIN_CHUNKS = 10
+# Smallest exported row per seeded document (CSV); the seed is sized from these
+EXPORT_ROW_BYTES = {"orders": 150, "analytics": 100}
+# Memory an export may gain between its first and its largest chunk, in chunks:
+# one being encoded, one being sent, allocator noise
+EXPORT_MEMORY_SLACK_CHUNKS = 4
+
+
+def export_seed_rows(kind, chunk_bytes):
+    """Documents to seed so every export of ``kind`` spans EXPORT_MIN_CHUNKS chunks, with a margin"""
+    return math.ceil(1.5 * EXPORT_MIN_CHUNKS * chunk_bytes / EXPORT_ROW_BYTES[kind])
+
+
+async def seed(products, orders, analytics, image_kb=0):
+    """Reset ``server.db`` to a fresh in-memory catalog of the requested size"""
+    server.db = MemoryStorage(server.db_observers)
+    server.catalog_snapshots = CatalogSnapshots.from_env()
+    await server.startup_event()
+
+    categories = await server.db.categories.find({}, {'_id': 0}).to_list(None)
+    product_ids = []
+    for i in range(products):
+        product = server.Product(**{
+            **TEST_PRODUCT,
+            "name_en": f"Benchmark Product {i}",
+            "category_id": categories[i % len(categories)]["id"],
+            "category": categories[i % len(categories)]["name_pt"],
+            "featured": i % 5 == 0,
+            "price": round(random.uniform(2, 60), 2),
+            "image_url": inline_image(image_kb) if image_kb else None,
+        })
+        doc = product.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        doc['updated_at'] = doc['updated_at'].isoformat()
+        await server.db.products.insert_one(doc)
+        product_ids.append(product.id)
+    await server.rebuild_category_counts()
+
+    now = datetime.now(timezone.utc)
+    for _ in range(orders):
+        picked = random.sample(product_ids, k=min(3, len(product_ids)))
+        order = server.Order(
+            guest_name="Bench Guest", room_number="12", phone="+5521900000000",
+            delivery_preference="At the door",
+            items=[server.OrderItem(product_id=pid, name="x", price=10.0, quantity=1) for pid in picked],
+            total=10.0 * len(picked),
+            status=random.choice(["pending", "confirmed", "completed", "cancelled"]),
+            created_at=now - timedelta(days=random.randint(0, 30)),
+        )
+        doc = order.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        doc['updated_at'] = doc['updated_at'].isoformat()
+        await server.db.orders.insert_one(doc)
+
+    for _ in range(analytics):
+        event = server.ProductAnalytics(
+            product_id=random.choice(product_ids),
+            event_type=random.choice(["view", "view", "view", "add_to_cart", "order"]),
+            timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * 30)),
+        )
+        server.unique_counter.add(event.product_id, event.event_type,
+                                  f"session-{random.randint(0, analytics // 5)}", event.timestamp)
+        await server.db.analytics.insert_one(event.model_dump())
+    await server.unique_counter.flush()
+    # Reports read the daily rollups for past days, as in production
+    await server.analytics_retention.run_once(server.db)
+
+    return product_ids, [c["name_pt"] for c in categories]
+
+
+def build_cases(product_ids, category_names):
+    """Benchmark cases as (name, method, path, kwargs, needs_auth)"""
+    product_id = random.choice(product_ids) if product_ids else "missing"
+    order_items = [{"product_id": pid, "name": "x", "price": 10.0, "quantity": 1} for pid in product_ids[:3]]
+    order = {"guest_name": "Bench Guest", "room_number": "12", "phone": "+5521900000000",
+             "delivery_preference": "At the door", "items": order_items, "total": 10.0 * len(order_items)}
+    idempotency_key = {"Idempotency-Key": f"bench-{random.getrandbits(64):x}"}
+    return [
+        ("GET /products", "GET", "/api/products", {}, False),
+        ("GET /products?category", "GET", "/api/products", {"params": {"category": category_names[0]}}, False),
+        ("GET /products/{id}", "GET", f"/api/products/{product_id}", {}, False),
+        ("GET /categories", "GET", "/api/categories", {}, False),
+        ("GET /settings", "GET", "/api/settings", {}, False),
+        ("GET /catalog", "GET", "/api/catalog", {}, False),
+        ("GET /catalog?since", "GET", "/api/catalog", {"params": {"since": 1}}, False),
+        ("GET /auth/me", "GET", "/api/auth/me", {}, True),
+        ("POST /analytics/track", "POST", "/api/analytics/track",
+         {"json": {"product_id": product_id, "event_type": "view"}}, False),
+        ("POST /orders", "POST", "/api/orders", {"json": order}, False),
+        # The first request with a key places the order, every later one replays it
+        ("POST /orders+key", "POST", "/api/orders", {"json": order, "headers": idempotency_key}, False),
+        ("POST /orders+key retry", "POST", "/api/orders", {"json": order, "headers": idempotency_key}, False),
+        ("GET /orders", "GET", "/api/orders", {}, True),
+        ("GET /orders?start_date", "GET", "/api/orders",
+         {"params": {"start_date": (datetime.now(timezone.utc) - timedelta(days=365)).isoformat()}}, True),
+        ("GET /analytics/summary", "GET", "/api/analytics/summary", {}, True),
+        ("GET /analytics/products", "GET", "/api/analytics/products", {}, True),
+        ("GET /admin/dashboard", "GET", "/api/admin/dashboard", {}, True),
+    ]
+
+
+async def login_headers(client, needs_auth):
+    if not needs_auth:
+        return {}
+    login = await client.post("/api/auth/login", json=ADMIN_CREDENTIALS)
+    return {"Authorization": f"Bearer {login.json()['token']}"}
+
+
+async def run_case(name, args):
+    product_ids, category_names = await seed(args.products, args.orders, args.analytics, args.image_kb)
+    cases = {c[0]: c for c in build_cases(product_ids, category_names)}
+    _, method, path, kwargs, needs_auth = cases[name]
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {**await login_headers(client, needs_auth), **kwargs.pop("headers", {})}
+
+        for _ in range(args.warmup):
+            await client.request(method, path, headers=headers, **kwargs)
+
+        stats = EndpointStats()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            response = await client.request(method, path, headers=headers, **kwargs)
+            stats.record((time.perf_counter() - t0) * 1000, response.status_code, response.status_code == 200)
+        elapsed = time.perf_counter() - start
+    return stats.summary(elapsed)
+
+
+CATALOG_ENDPOINTS = (
+    ("GET /products", "/api/products"),
+    ("GET /categories", "/api/categories"),
+    ("GET /catalog", "/api/catalog"),
+)
+CATALOG_MODES = (
+    ("per-request JSON", False, "identity"),
+    ("snapshot identity", True, "identity"),
+    ("snapshot gzip", True, "gzip"),
+    ("snapshot br", True, "br"),
+)
+
+
+async def catalog_report(args):
+    """Bytes and time per request for the catalog endpoints with and without snapshots"""
+    await seed(args.products, 0, 0, args.image_kb)
+    report = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, path in CATALOG_ENDPOINTS:
+            for mode, enabled, encoding in CATALOG_MODES:
+                server.catalog_snapshots.enabled = enabled
+                headers = {"Accept-Encoding": encoding}
+                for _ in range(args.warmup):
+                    await client.get(path, headers=headers)
+                wire_bytes = 0
+                cpu_start, wall_start = time.process_time(), time.perf_counter()
+                for _ in range(args.iterations):
+                    # Read the raw body so client-side decompression is not measured
+                    async with client.stream("GET", path, headers=headers) as response:
+                        wire_bytes = sum([len(chunk) async for chunk in response.aiter_raw()])
+                wall = (time.perf_counter() - wall_start) / args.iterations * 1000
+                cpu = (time.process_time() - cpu_start) / args.iterations * 1000
+                served = response.headers.get("content-encoding", "identity")
+                report.setdefault(name, {})[mode] = {
+                    "encoding": served, "bytes": wire_bytes, "wall_ms": round(wall, 3), "cpu_ms": round(cpu, 3),
+                }
+                print(f"{name:<18}{mode:<20}{served:>9}{wire_bytes:>12}{wall:>10.3f}{cpu:>10.3f}")
+    server.catalog_snapshots.enabled = True
+    return report
+
+
+async def measure_db_calls():
+    """``X-DB-Calls`` of every case as ``{name: [small catalog, large catalog]}``"""
+    calls = {}
+    for sizes in BUDGET_SIZES:
+        product_ids, category_names = await seed(**sizes)
+        # Catalog version re-reads depend on wall time, not data size; keep them out of the counts
+        server.catalog_snapshots.version_ttl_s = float("inf")
+        transport = httpx.ASGITransport(app=server.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name, method, path, kwargs, needs_auth in build_cases(product_ids, category_names):
+                    headers = {**await login_headers(client, needs_auth), **kwargs.pop("headers", {})}
+                    response = await client.request(method, path, headers=headers, **kwargs)
+                    calls.setdefault(name, []).append(int(response.headers["x-db-calls"]))
+        finally:
+            # Stop the background tasks and the stall watchdog started by seed()
+            await server.shutdown_db_client()
+    return calls
+
+
+def budget_violations(name, small, large):
+    budget = QUERY_BUDGETS.get(name)
+    violations = []
+    if budget is None:
+        violations.append(f"{name}: no query budget defined")
+    elif large > budget:
+        violations.append(f"{name}: {large} queries, budget is {budget}")
+    if large > small:
+        violations.append(f"{name}: query count grows with data size ({small} -> {large})")
+    return violations
+
+
+async def check_budgets():
+    """Return budget violations as human readable lines"""
+    violations = []
+    for name, (small, large) in (await measure_db_calls()).items():
+        budget = QUERY_BUDGETS.get(name)
+        print(f"{name:<28}{small:>8}{large:>8}{budget if budget is not None else '-':>8}")
+        violations.extend(budget_violations(name, small, large))
+    return violations
+
+
+async def stream_export_memory(path, query_string, token):
+    """Stream one export straight through the ASGI app; returns (status, bytes, chunks, memory growth)"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query_string.encode(), "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+    }
+    result = {"status": None, "bytes": 0, "chunks": 0, "first": None, "max": 0}
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # StreamingResponse listens for the client going away while it streams
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # httpx.ASGITransport would buffer the whole body; count each chunk and drop it instead
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif not message.get("more_body"):
+            finished.set()
+        if message.get("body"):
+            result["bytes"] += len(message["body"])
+            result["chunks"] += 1
+            current = tracemalloc.get_traced_memory()[0]
+            if result["first"] is None:
+                result["first"] = current
+            result["max"] = max(result["max"], current)
+
+    tracemalloc.start()
+    try:
+        await server.app(scope, receive, send)
+    finally:
+        tracemalloc.stop()
+    return result["status"], result["bytes"], result["chunks"], result["max"] - (result["first"] or 0)
+
+
+async def check_export_memory(products=100, orders=0, analytics=0):
+    """Return export memory violations as human readable lines"""
+    chunk_bytes = exports.EXPORT_CHUNK_BYTES
+    await seed(products, max(orders, export_seed_rows("orders", chunk_bytes)),
+               max(analytics, export_seed_rows("analytics", chunk_bytes)))
+    violations = []
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            login = await client.post("/api/auth/login", json=ADMIN_CREDENTIALS)
+            token = login.json()["token"]
+
+        for name, path, query_string in EXPORT_CASES:
+            status, size, chunks, growth = await stream_export_memory(path, query_string, token)
+            print(f"{name:<20}{size / 1024:>12.0f}{chunks:>8}{growth / 1024:>12.1f}")
+            if status != 200:
+                violations.append(f"{name}: HTTP {status}")
+            elif chunks < size / (2 * chunk_bytes):
+                violations.append(f"{name}: {size / 1024:.0f} KB sent in {chunks} chunk(s), the body is buffered")
+            elif size < EXPORT_MIN_CHUNKS * chunk_bytes:
+                violations.append(f"{name}: only {size / 1024:.0f} KB exported, seed more rows to measure streaming")
+            elif growth > EXPORT_MEMORY_SLACK_CHUNKS * chunk_bytes:
+                violations.append(f"{name}: memory grew by {growth / 1024:.0f} KB while streaming")
+    finally:
+        await server.shutdown_db_client()
+    return violations
+
+
+async def run_benchmarks(args):
+    names = [c[0] for c in build_cases(["x"], ["x"])]
+    if args.only:
+        names = [n for n in names if any(pattern in n for pattern in args.only)]
+    endpoints = {}
+    for name in names:
+        endpoints[name] = await run_case(name, args)
+        lat = endpoints[name]["latency_ms"]
+        print(f"{name:<28}{lat['p50']:>9.3f}{lat['p95']:>9.3f}{lat['p99']:>9.3f}"
+              f"{endpoints[name]['throughput_rps']:>11.1f}")
+    return endpoints
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--analytics", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--only", action="append", help="substring of endpoint names to run (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--image-kb", type=int, default=0, help="inline image size per product")
+    parser.add_argument("--check-budgets", action="store_true", help="enforce QUERY_BUDGETS and exit")
+    parser.add_argument("--catalog-report", action="store_true",
+                        help="compare catalog snapshots with per-request rendering and exit")
+    parser.add_argument("--check-export-memory", action="store_true",
+                        help="stream the exports of a seeded history and fail if memory grows")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.check_budgets:
+        print(f"{'endpoint':<28}{'small':>8}{'large':>8}{'budget':>8}")
+        violations = asyncio.run(check_budgets())
+        if violations:
+            print("⚠️  Query budget violations:")
+            for line in violations:
+                print(f"   {line}")
+            return 1
+        print("🎉 All endpoints within their query budgets")
+        return 0
+
+    if args.check_export_memory:
+        print(f"{'export':<20}{'KB sent':>12}{'chunks':>8}{'growth KB':>12}")
+        violations = asyncio.run(check_export_memory(args.products, args.orders, args.analytics))
+        if violations:
+            print("⚠️  Export memory violations:")
+            for line in violations:
+                print(f"   {line}")
+            return 1
+        print("🎉 Exports stream in constant memory")
+        return 0
+
+    if args.catalog_report:
+        print(f"{'endpoint':<18}{'mode':<20}{'encoding':>9}{'bytes':>12}{'wall ms':>10}{'cpu ms':>10}")
+        report = asyncio.run(catalog_report(args))
+        with open(args.output, "w") as f:
+            json.dump({"timestamp": datetime.now().isoformat(), "catalog_report": report}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+        return 0
+
+    print(f"🚀 Handler micro-benchmarks: products={args.products} orders={args.orders} "
+          f"analytics={args.analytics} iterations={args.iterations}")
+    print(f"{'endpoint':<28}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>11}")
+    endpoints = asyncio.run(run_benchmarks(args))
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "storage": "memory",
+            "products": args.products,
+            "orders": args.orders,
+            "analytics": args.analytics,
+            "iterations": args.iterations,
+        },
+        "endpoints": endpoints,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance, min_delta_ms=0.05)
+        if regressions:
+            print("⚠️  Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("🎉 No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
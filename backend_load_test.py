@@ -0,0 +1,437 @@
+"""Concurrent load generator for the Teruza API.
+
+Replays the TeruzoAPITester scenarios (catalog browse, analytics tracking,
+checkout and admin polling) with an async client at a configurable
+concurrency, then reports latency percentiles, throughput and error rate per
+endpoint. Results are written as JSON and can be compared against a previous
+run to catch regressions:
+
+    python backend_load_test.py --spawn-server --concurrency 50 --duration 30 \\
+        --output results.json --baseline previous.json
+
+``--sweep`` repeats the run against a freshly spawned server for each value
+of one server environment variable and tabulates tail latency and Mongo
+connection pool waits side by side, e.g. to size the pool per worker:
+
+    python backend_load_test.py --spawn-server --concurrency 100 \\
+        --sweep MONGO_MAX_POOL_SIZE=5,20,100
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from backend_test import ADMIN_CREDENTIALS, TEST_PRODUCT
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+DEFAULT_BASE_URL = os.environ.get("BACKEND_URL", "http://localhost:8001")
+DEFAULT_MIX = "browse=6,track=3,checkout=1,admin=1"
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = 0
+        self.status_codes = {}
+
+    def record(self, elapsed_ms, status_code, ok):
+        self.latencies_ms.append(elapsed_ms)
+        key = str(status_code)
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed_s):
+        latencies = sorted(self.latencies_ms)
+        count = len(latencies)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / elapsed_s, 2) if elapsed_s else 0.0,
+            "status_codes": self.status_codes,
+            "latency_ms": {
+                "min": round(latencies[0], 2) if latencies else 0.0,
+                "mean": round(sum(latencies) / count, 2) if count else 0.0,
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "max": round(latencies[-1], 2) if latencies else 0.0,
+            },
+        }
+
+
+class LoadClient:
+    """Thin async wrapper that times every request under a stable endpoint name"""
+
+    def __init__(self, client, stats):
+        self.client = client
+        self.stats = stats
+        self.token = None
+
+    async def call(self, name, method, path, expected_status=200, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        start = time.perf_counter()
+        status_code = 0
+        response = None
+        try:
+            response = await self.client.request(method, f"/api/{path}", headers=headers, **kwargs)
+            status_code = response.status_code
+        except httpx.HTTPError:
+            pass
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        ok = status_code == expected_status
+        self.stats.setdefault(name, EndpointStats()).record(elapsed_ms, status_code, ok)
+        if ok and response is not None and response.headers.get("content-type", "").startswith("application/json"):
+            return response.json()
+        return None
+
+
+# Scenarios mirror the guest and admin flows exercised by TeruzoAPITester
+async def scenario_browse(client, ctx):
+    await client.call("GET /categories", "GET", "categories")
+    await client.call("GET /products", "GET", "products")
+    if ctx["categories"]:
+        category = random.choice(ctx["categories"])
+        await client.call("GET /products?category", "GET", "products", params={"category": category})
+    await client.call("GET /products?featured", "GET", "products", params={"featured": "true"})
+    if ctx["product_ids"]:
+        product_id = random.choice(ctx["product_ids"])
+        await client.call("GET /products/{id}", "GET", f"products/{product_id}")
+
+
+async def scenario_track(client, ctx):
+    if not ctx["product_ids"]:
+        return
+    product_id = random.choice(ctx["product_ids"])
+    for event_type in ("view", "add_to_cart"):
+        await client.call(
+            f"POST /analytics/track ({event_type})", "POST", "analytics/track",
+            json={"product_id": product_id, "event_type": event_type}
+        )
+
+
+async def scenario_checkout(client, ctx):
+    await client.call("GET /settings", "GET", "settings")
+    if not ctx["products"]:
+        return
+    picked = random.sample(ctx["products"], k=min(3, len(ctx["products"])))
+    items = [
+        {"product_id": p["id"], "name": p["name_en"], "price": p["price"], "quantity": random.randint(1, 3)}
+        for p in picked
+    ]
+    order = {
+        "guest_name": "Load Test Guest",
+        "room_number": str(random.randint(1, 40)),
+        "phone": "+5521900000000",
+        "delivery_preference": "At the door",
+        "notes": "load test",
+        "items": items,
+        "total": round(sum(i["price"] * i["quantity"] for i in items), 2),
+    }
+    await client.call("POST /orders", "POST", "orders", json=order)
+
+
+async def scenario_admin(client, ctx):
+    client.token = ctx["token"]
+    try:
+        await client.call("GET /orders", "GET", "orders")
+        await client.call("GET /analytics/summary", "GET", "analytics/summary")
+        await client.call("GET /analytics/products", "GET", "analytics/products")
+    finally:
+        client.token = None
+
+
+SCENARIOS = {
+    "browse": scenario_browse,
+    "track": scenario_track,
+    "checkout": scenario_checkout,
+    "admin": scenario_admin,
+}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {sorted(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def prepare_context(client, min_products):
+    """Log in as admin and make sure the catalog has products to browse and order"""
+    response = await client.post("/api/auth/login", json=ADMIN_CREDENTIALS)
+    response.raise_for_status()
+    token = response.json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    categories = [c["name_pt"] for c in (await client.get("/api/categories")).json()]
+    products = (await client.get("/api/products")).json()
+    for i in range(len(products), min_products):
+        product = dict(TEST_PRODUCT)
+        product["name_en"] = f"Load Test Product {i}"
+        product["category"] = categories[i % len(categories)] if categories else TEST_PRODUCT["category"]
+        product["featured"] = i % 4 == 0
+        created = await client.post("/api/products", json=product, headers=headers)
+        created.raise_for_status()
+        products.append(created.json())
+
+    return {
+        "token": token,
+        "categories": categories,
+        "products": products,
+        "product_ids": [p["id"] for p in products],
+    }
+
+
+async def run_load(base_url, concurrency, duration, warmup, mix, min_products, timeout):
+    weights = parse_mix(mix)
+    names = list(weights)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as http:
+        ctx = await prepare_context(http, min_products)
+
+        async def worker(stats, deadline):
+            client = LoadClient(http, stats)
+            while time.perf_counter() < deadline:
+                scenario = random.choices(names, weights=[weights[n] for n in names])[0]
+                await SCENARIOS[scenario](client, ctx)
+
+        if warmup > 0:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(worker({}, deadline) for _ in range(concurrency)))
+
+        stats = {}
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(worker(stats, deadline) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    total = EndpointStats()
+    for endpoint_stats in stats.values():
+        total.latencies_ms.extend(endpoint_stats.latencies_ms)
+        total.errors += endpoint_stats.errors
+        for code, count in endpoint_stats.status_codes.items():
+            total.status_codes[code] = total.status_codes.get(code, 0) + count
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "base_url": base_url,
+            "concurrency": concurrency,
+            "duration_s": duration,
+            "warmup_s": warmup,
+            "mix": weights,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": total.summary(elapsed),
+        "endpoints": {name: s.summary(elapsed) for name, s in sorted(stats.items())},
+    }
+
+
+def compare_results(current, baseline, tolerance, min_delta_ms=2.0):
+    """Return human readable regressions of ``current`` against ``baseline``"""
+    regressions = []
+    for name, cur in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["count"]:
+            continue
+        for q in ("p50", "p95", "p99"):
+            before, after = base["latency_ms"][q], cur["latency_ms"][q]
+            if after > before * (1 + tolerance) and after - before > min_delta_ms:
+                regressions.append(f"{name}: {q} {before:.1f}ms -> {after:.1f}ms")
+        if cur["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {base['error_rate']:.2%} -> {cur['error_rate']:.2%}")
+        if cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {base['throughput_rps']:.1f} -> {cur['throughput_rps']:.1f} req/s"
+            )
+    return regressions
+
+
+@contextmanager
+def spawn_server(port, workers, env_overrides):
+    """Run a local uvicorn for the duration of the load test"""
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "teruza_loadtest")
+    # Every virtual user shares one client IP; per-IP limits would turn the run into 429s
+    env.setdefault("RATE_LIMITS", "")
+    env.setdefault("SESSION_RATE_LIMITS", "")
+    env.update(env_overrides)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if process.poll() is not None or time.time() > deadline:
+                raise RuntimeError("Local server did not become ready")
+            time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def scrape_pool_metrics(base_url):
+    """Connection pool wait statistics from the server's /metrics endpoint"""
+    try:
+        text = httpx.get(f"{base_url}/metrics", timeout=5).text
+    except httpx.HTTPError:
+        return {}
+    totals = {}
+    for line in text.splitlines():
+        for metric in ("mongodb_pool_checkout_wait_seconds_sum", "mongodb_pool_checkout_wait_seconds_count",
+                       "mongodb_pool_checkout_failures_total", "mongodb_pool_connections_created_total"):
+            if line.startswith(metric):
+                totals[metric] = totals.get(metric, 0.0) + float(line.rsplit(" ", 1)[1])
+    count = totals.get("mongodb_pool_checkout_wait_seconds_count", 0)
+    return {
+        "checkouts": int(count),
+        "avg_checkout_wait_ms": round(totals.get("mongodb_pool_checkout_wait_seconds_sum", 0) / count * 1000, 3)
+        if count else 0.0,
+        "checkout_failures": int(totals.get("mongodb_pool_checkout_failures_total", 0)),
+        "connections_created": int(totals.get("mongodb_pool_connections_created_total", 0)),
+    }
+
+
+def print_sweep(variable, runs):
+    print(f"\n📈 Sweep over {variable}")
+    print(f"{'value':>10}{'rps':>9}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'pool wait':>11}{'conns':>7}")
+    for run in runs:
+        total = run["results"]["total"]
+        lat = total["latency_ms"]
+        pool = run["results"].get("pool", {})
+        print(f"{run['value']:>10}{total['throughput_rps']:>9.1f}{total['error_rate'] * 100:>7.1f}"
+              f"{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}"
+              f"{pool.get('avg_checkout_wait_ms', 0):>9.2f}ms{pool.get('connections_created', 0):>7}")
+
+
+def print_report(results):
+    print(f"\n📊 {results['total']['count']} requests in {results['elapsed_s']}s "
+          f"({results['total']['throughput_rps']} req/s, "
+          f"{results['total']['error_rate']:.2%} errors)")
+    print(f"{'endpoint':<36}{'count':>8}{'rps':>9}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in results["endpoints"].items():
+        lat = s["latency_ms"]
+        print(f"{name:<36}{s['count']:>8}{s['throughput_rps']:>9.1f}{s['error_rate'] * 100:>7.1f}"
+              f"{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted scenarios, e.g. browse=6,admin=1")
+    parser.add_argument("--min-products", type=int, default=20, help="seed the catalog up to this size")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--spawn-server", action="store_true", help="start a local uvicorn for the run")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the spawned server (repeatable)")
+    parser.add_argument("--sweep", metavar="KEY=V1,V2,...",
+                        help="run once per value of a server environment variable (needs --spawn-server)")
+    args = parser.parse_args(argv)
+    if args.sweep and not args.spawn_server:
+        parser.error("--sweep requires --spawn-server")
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    def run(base_url):
+        return asyncio.run(run_load(
+            base_url, args.concurrency, args.duration, args.warmup,
+            args.mix, args.min_products, args.timeout
+        ))
+
+    def run_spawned(server_env):
+        with spawn_server(args.port, args.workers, server_env) as base_url:
+            results = run(base_url)
+            results["pool"] = scrape_pool_metrics(base_url)
+        results["config"]["server_env"] = server_env
+        results["config"]["workers"] = args.workers
+        return results
+
+    print(f"🚀 Load test: concurrency={args.concurrency} duration={args.duration}s mix={args.mix}")
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+    if args.sweep:
+        variable, _, values = args.sweep.partition("=")
+        runs = []
+        for value in values.split(","):
+            print(f"\n▶️  {variable}={value}")
+            results = run_spawned({**server_env, variable: value})
+            print_report(results)
+            runs.append({"value": value, "results": results})
+        print_sweep(variable, runs)
+        with open(args.output, "w") as f:
+            json.dump({"sweep": {"variable": variable, "runs": runs}}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+        return 0
+
+    if args.spawn_server:
+        results = run_spawned(server_env)
+    else:
+        results = run(args.base_url)
+
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print("⚠️  Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("🎉 No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,8 +3,27 @@ import sys
 import json
 from datetime import datetime
 
+DEFAULT_BASE_URL = "https://br-dashboard.preview.emergentagent.com"
+
+ADMIN_CREDENTIALS = {"email": "admin@teruza.com", "password": "password123"}
+
+TEST_PRODUCT = {
+    "active": True,
+    "featured": False,
+    "type": "product",
+    "category": "Bebidas",
+    "price": 15.99,
+    "currency": "BRL",
+    "name_pt": "Produto Teste",
+    "name_en": "Test Product",
+    "name_es": "Producto Prueba",
+    "desc_pt": "Descrição do produto teste",
+    "desc_en": "Test product description",
+    "desc_es": "Descripción del producto de prueba"
+}
+
 class TeruzoAPITester:
-    def __init__(self, base_url="https://br-dashboard.preview.emergentagent.com"):
+    def __init__(self, base_url=DEFAULT_BASE_URL):
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.token = None
@@ -76,7 +95,7 @@ class TeruzoAPITester:
             "POST",
             "auth/login",
             200,
-            data={"email": "admin@teruza.com", "password": "password123"}
+            data=ADMIN_CREDENTIALS
         )
         if success and 'token' in response:
             self.token = response['token']
@@ -121,27 +140,12 @@ class TeruzoAPITester:
 
     def test_create_product(self):
         """Test create product"""
-        product_data = {
-            "active": True,
-            "featured": False,
-            "type": "product",
-            "category": "Test Category",
-            "price": 15.99,
-            "currency": "BRL",
-            "name_pt": "Produto Teste",
-            "name_en": "Test Product",
-            "name_es": "Producto Prueba",
-            "desc_pt": "Descrição do produto teste",
-            "desc_en": "Test product description",
-            "desc_es": "Descripción del producto de prueba"
-        }
-        
         success, response = self.run_test(
             "Create Product",
             "POST",
             "products",
             200,
-            data=product_data
+            data=TEST_PRODUCT
         )
         
         if success and 'id' in response:
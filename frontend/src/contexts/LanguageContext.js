@@ -41,6 +41,7 @@ const translations = {
     copyOrder: 'Copiar pedido',
     paymentNote: 'O pagamento será combinado na entrega ou no checkout.',
     orderReady: 'Seu pedido está pronto para ser enviado',
+    tooManyOrders: 'Muitos pedidos em pouco tempo. Aguarde um minuto e tente novamente.',
     confirmWhatsApp: 'Confirme no WhatsApp',
     openingHours: 'Horário de Funcionamento',
     hours: '11:00 - 22:00',
@@ -143,6 +144,8 @@ const translations = {
       orderDeleted: 'Pedido excluído com sucesso',
       analyticsEntriesRemoved: 'entradas de análise removidas',
       failedToDeleteOrder: 'Falha ao excluir pedido',
+      exportCsv: 'Exportar CSV',
+      failedToExport: 'Falha ao exportar pedidos',
       // Analytics
       analyticsInsights: 'Análises e Insights',
       totalOrders: 'Total de Pedidos',
@@ -156,6 +159,7 @@ const translations = {
       trackPerformance: 'Acompanhe visualizações, adições ao carrinho, pedidos e receita de cada produto',
       resetAnalytics: 'Resetar Análises',
       views: 'Visualizações',
+      uniqueViewers: 'únicas',
       addToCartLabel: 'Add. Carrinho',
       conversion: 'Conversão',
       revenue: 'Receita',
@@ -250,6 +254,7 @@ const translations = {
     copyOrder: 'Copy order',
     paymentNote: 'Payment will be arranged on delivery or at checkout.',
     orderReady: 'Your order is ready to be sent',
+    tooManyOrders: 'Too many orders in a short time. Please wait a minute and try again.',
     confirmWhatsApp: 'Confirm on WhatsApp',
     openingHours: 'Opening Hours',
     hours: '11:00 AM - 10:00 PM',
@@ -352,6 +357,8 @@ const translations = {
       orderDeleted: 'Order deleted successfully',
       analyticsEntriesRemoved: 'analytics entries removed',
       failedToDeleteOrder: 'Failed to delete order',
+      exportCsv: 'Export CSV',
+      failedToExport: 'Failed to export orders',
       // Analytics
       analyticsInsights: 'Analytics & Insights',
       totalOrders: 'Total Orders',
@@ -365,6 +372,7 @@ const translations = {
       trackPerformance: 'Track views, cart additions, orders, and revenue for each product',
       resetAnalytics: 'Reset Analytics',
       views: 'Views',
+      uniqueViewers: 'unique',
       addToCartLabel: 'Add to Cart',
       conversion: 'Conversion',
       revenue: 'Revenue',
@@ -459,6 +467,7 @@ const translations = {
     copyOrder: 'Copiar pedido',
     paymentNote: 'El pago se coordinará en la entrega o en el checkout.',
     orderReady: 'Tu pedido está listo para ser enviado',
+    tooManyOrders: 'Demasiados pedidos en poco tiempo. Espera un minuto e inténtalo de nuevo.',
     confirmWhatsApp: 'Confirmar en WhatsApp',
     openingHours: 'Horario de Apertura',
     hours: '11:00 - 22:00',
@@ -561,6 +570,8 @@ const translations = {
       orderDeleted: 'Pedido eliminado exitosamente',
       analyticsEntriesRemoved: 'entradas de análisis eliminadas',
       failedToDeleteOrder: 'Error al eliminar el pedido',
+      exportCsv: 'Exportar CSV',
+      failedToExport: 'Error al exportar los pedidos',
       // Analytics
       analyticsInsights: 'Análisis e Información',
       totalOrders: 'Total de Pedidos',
@@ -574,6 +585,7 @@ const translations = {
       trackPerformance: 'Seguimiento de vistas, adiciones al carrito, pedidos e ingresos de cada producto',
       resetAnalytics: 'Resetear Análisis',
       views: 'Vistas',
+      uniqueViewers: 'únicas',
       addToCartLabel: 'Añadir al Carrito',
       conversion: 'Conversión',
       revenue: 'Ingresos',
@@ -0,0 +1,62 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+const STORAGE_KEY = 'teruza-catalog';
+
+let pending = null;
+
+const loadCached = () => {
+  try {
+    const cached = JSON.parse(localStorage.getItem(STORAGE_KEY));
+    return cached && typeof cached.version === 'number' ? cached : null;
+  } catch (error) {
+    return null;
+  }
+};
+
+// Replace changed items in place, append new ones and drop deleted ids
+const mergeById = (items, changed, deletedIds) => {
+  const deleted = new Set(deletedIds);
+  const updates = new Map(changed.map((item) => [item.id, item]));
+  const merged = items
+    .filter((item) => !deleted.has(item.id))
+    .map((item) => {
+      const update = updates.get(item.id);
+      updates.delete(item.id);
+      return update ?? item;
+    });
+  return [...merged, ...updates.values()];
+};
+
+const syncCatalog = async () => {
+  const cached = loadCached();
+  const params = cached ? { since: cached.version } : {};
+  const { data } = await axios.get(`${API}/catalog`, { params });
+
+  const catalog = data.full || !cached
+    ? { version: data.version, categories: data.categories, products: data.products, settings: data.settings }
+    : {
+        version: data.version,
+        categories: mergeById(cached.categories, data.categories, data.deleted_categories),
+        products: mergeById(cached.products, data.products, data.deleted_products),
+        settings: data.settings,
+      };
+
+  try {
+    localStorage.setItem(STORAGE_KEY, JSON.stringify(catalog));
+  } catch (error) {
+    // Storage full or disabled; the catalog still works for this page view
+  }
+  return catalog;
+};
+
+// Categories, active products and settings; concurrent callers share one request
+export const fetchCatalog = () => {
+  if (!pending) {
+    pending = syncCatalog().finally(() => {
+      pending = null;
+    });
+  }
+  return pending;
+};
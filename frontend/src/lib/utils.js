@@ -29,6 +29,29 @@ export const CATEGORIES = [
 
 export const WHATSAPP_NUMBER = '5521988760870';
 
+export const randomId = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+// Anonymous id per browser, used only to count distinct viewers and buyers
+export const getSessionId = () => {
+  try {
+    let sessionId = localStorage.getItem('teruza-session');
+    if (!sessionId) {
+      sessionId = randomId();
+      localStorage.setItem('teruza-session', sessionId);
+    }
+    return sessionId;
+  } catch (error) {
+    return null;
+  }
+};
+
+// Public writes are rate limited per session; without this header the limit is per IP
+export const sessionHeaders = () => {
+  const sessionId = getSessionId();
+  return sessionId ? { 'X-Session-Id': sessionId } : {};
+};
+
 export const generateWhatsAppMessage = (order, language) => {
   const { name, room, phone, deliveryPreference, notes, items, total } = order;
   
@@ -15,7 +15,8 @@ import {
 import { motion } from 'framer-motion';
 import { Search, Plus, Minus, X } from 'lucide-react';
 import axios from 'axios';
-import { formatCurrency } from '@/lib/utils';
+import { formatCurrency, getSessionId, sessionHeaders } from '@/lib/utils';
+import { fetchCatalog } from '@/lib/catalog';
 import { toast } from 'sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -29,7 +30,7 @@ const CatalogPage = () => {
   const [categories, setCategories] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchQuery, setSearchQuery] = useState('');
-  const [selectedCategory, setSelectedCategory] = useState(searchParams.get('category') || '');
+  const [selectedCategory, setSelectedCategory] = useState(searchParams.get('category_id') || '');
   
   // Product detail modal state
   const [selectedProduct, setSelectedProduct] = useState(null);
@@ -37,16 +38,27 @@ const CatalogPage = () => {
   const [quantity, setQuantity] = useState(1);
 
   useEffect(() => {
-    fetchCategories();
-    fetchProducts();
-  }, [selectedCategory]);
+    fetchCatalogData();
+  }, []);
 
-  const fetchCategories = async () => {
+  useEffect(() => {
+    // Older links name the category by its Portuguese name instead of its id
+    const legacyName = searchParams.get('category');
+    if (selectedCategory || !legacyName || categories.length === 0) return;
+    const match = categories.find((category) => category.name_pt === legacyName);
+    handleCategoryChange(match ? match.id : '', { replace: true });
+  }, [categories]);
+
+  const fetchCatalogData = async () => {
     try {
-      const response = await axios.get(`${API}/categories`);
-      setCategories(response.data);
+      setLoading(true);
+      const catalog = await fetchCatalog();
+      setCategories(catalog.categories);
+      setProducts(catalog.products);
     } catch (error) {
-      console.error('Failed to fetch categories:', error);
+      console.error('Failed to fetch catalog:', error);
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -56,22 +68,6 @@ const CatalogPage = () => {
     return category.name_en;
   };
 
-  const fetchProducts = async () => {
-    try {
-      setLoading(true);
-      const params = { active_only: true };
-      if (selectedCategory) {
-        params.category = selectedCategory;
-      }
-      const response = await axios.get(`${API}/products`, { params });
-      setProducts(response.data);
-    } catch (error) {
-      console.error('Failed to fetch products:', error);
-    } finally {
-      setLoading(false);
-    }
-  };
-
   const getProductName = (product) => {
     if (language === 'pt') return product.name_pt;
     if (language === 'es') return product.name_es;
@@ -85,6 +81,7 @@ const CatalogPage = () => {
   };
 
   const filteredProducts = products.filter(product => {
+    if (selectedCategory && product.category_id !== selectedCategory) return false;
     const name = getProductName(product).toLowerCase();
     const desc = getProductDesc(product).toLowerCase();
     return name.includes(searchQuery.toLowerCase()) || desc.includes(searchQuery.toLowerCase());
@@ -103,8 +100,9 @@ const CatalogPage = () => {
     // Track analytics
     axios.post(`${API}/analytics/track`, {
       product_id: product.id,
-      event_type: 'add_to_cart'
-    }).catch(err => console.error('Analytics tracking failed:', err));
+      event_type: 'add_to_cart',
+      session_id: getSessionId()
+    }, { headers: sessionHeaders() }).catch(err => console.error('Analytics tracking failed:', err));
   };
 
   // Handle opening product detail modal
@@ -116,8 +114,9 @@ const CatalogPage = () => {
     // Track view analytics
     axios.post(`${API}/analytics/track`, {
       product_id: product.id,
-      event_type: 'view'
-    }).catch(err => console.error('Analytics tracking failed:', err));
+      event_type: 'view',
+      session_id: getSessionId()
+    }, { headers: sessionHeaders() }).catch(err => console.error('Analytics tracking failed:', err));
   };
 
   // Handle adding to cart from modal (with quantity)
@@ -137,8 +136,9 @@ const CatalogPage = () => {
     // Track analytics
     axios.post(`${API}/analytics/track`, {
       product_id: selectedProduct.id,
-      event_type: 'add_to_cart'
-    }).catch(err => console.error('Analytics tracking failed:', err));
+      event_type: 'add_to_cart',
+      session_id: getSessionId()
+    }, { headers: sessionHeaders() }).catch(err => console.error('Analytics tracking failed:', err));
     
     // Show success message
     const productName = getProductName(selectedProduct);
@@ -154,12 +154,12 @@ const CatalogPage = () => {
     setQuantity(1);
   };
 
-  const handleCategoryChange = (category) => {
-    setSelectedCategory(category);
-    if (category) {
-      setSearchParams({ category });
+  const handleCategoryChange = (categoryId, options) => {
+    setSelectedCategory(categoryId);
+    if (categoryId) {
+      setSearchParams({ category_id: categoryId }, options);
     } else {
-      setSearchParams({});
+      setSearchParams({}, options);
     }
   };
 
@@ -205,11 +205,12 @@ const CatalogPage = () => {
               <Button
                 key={category.id}
                 data-testid={`category-filter-${category.name_pt.toLowerCase().replace(/\s+/g, '-')}`}
-                variant={selectedCategory === category.name_pt ? 'default' : 'outline'}
-                onClick={() => handleCategoryChange(category.name_pt)}
+                variant={selectedCategory === category.id ? 'default' : 'outline'}
+                onClick={() => handleCategoryChange(category.id)}
                 className="rounded-full whitespace-nowrap h-10 px-4 min-h-[40px] flex items-center"
               >
                 <span>{translatedCategory}</span>
+                <span className="ml-1.5 text-xs opacity-70">{category.active_product_count ?? 0}</span>
               </Button>
             );
           })}
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useLanguage } from '@/contexts/LanguageContext';
 import { useCart } from '@/contexts/CartContext';
@@ -9,7 +9,8 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@
 import { RadioGroup, RadioGroupItem } from '@/components/ui/radio-group';
 import { Textarea } from '@/components/ui/textarea';
 import { motion } from 'framer-motion';
-import { formatCurrency, WHATSAPP_NUMBER, generateWhatsAppMessage } from '@/lib/utils';
+import { formatCurrency, WHATSAPP_NUMBER, generateWhatsAppMessage, getSessionId, randomId, sessionHeaders } from '@/lib/utils';
+import { fetchCatalog } from '@/lib/catalog';
 import { toast } from 'sonner';
 import axios from 'axios';
 
@@ -30,6 +31,31 @@ const DDI_OPTIONS = [
   { code: 'OTHER', key: 'OTHER' },
 ];
 
+const RETRY_DELAYS_MS = [1000, 2000, 4000];
+// Longest Retry-After of a 429 worth waiting for before giving up and telling the guest
+const MAX_RETRY_AFTER_MS = 10000;
+
+// Every retry sends the same Idempotency-Key, so a flaky connection never places the order twice
+const postOrder = async (order, idempotencyKey) => {
+  for (let attempt = 0; ; attempt += 1) {
+    try {
+      return await axios.post(`${API}/orders`, order, {
+        headers: { ...sessionHeaders(), 'Idempotency-Key': idempotencyKey },
+      });
+    } catch (error) {
+      const status = error.response?.status;
+      const retryAfterMs = Number(error.response?.headers?.['retry-after'] || 0) * 1000;
+      const retryable = !error.response || status === 409 || status === 503
+        || (status === 429 && retryAfterMs <= MAX_RETRY_AFTER_MS);
+      if (!retryable || attempt >= RETRY_DELAYS_MS.length) {
+        throw error;
+      }
+      const delay = Math.max(RETRY_DELAYS_MS[attempt], retryAfterMs);
+      await new Promise((resolve) => setTimeout(resolve, delay));
+    }
+  }
+};
+
 const CheckoutPage = () => {
   const { t, language } = useLanguage();
   const navigate = useNavigate();
@@ -44,6 +70,9 @@ const CheckoutPage = () => {
     deliveryPreference: 'door',
     notes: '',
   });
+  const [submitting, setSubmitting] = useState(false);
+  // Idempotency key of the order being sent; a changed order gets a new one
+  const pendingOrder = useRef(null);
 
   const total = getTotal();
 
@@ -53,8 +82,8 @@ const CheckoutPage = () => {
 
   const fetchSettings = async () => {
     try {
-      const response = await axios.get(`${API}/settings`);
-      setWhatsappNumber(response.data.whatsapp_number);
+      const { settings } = await fetchCatalog();
+      setWhatsappNumber(settings.whatsapp_number);
     } catch (error) {
       console.error('Failed to fetch settings:', error);
       // Use default if fetch fails
@@ -87,11 +116,19 @@ const CheckoutPage = () => {
       notes: formData.notes,
       items: orderItems,
       total,
+      session_id: getSessionId(),
     };
 
+    const body = JSON.stringify(order);
+    if (pendingOrder.current?.body !== body) {
+      pendingOrder.current = { body, key: randomId() };
+    }
+
+    setSubmitting(true);
     try {
       // Create order in backend
-      await axios.post(`${API}/orders`, order);
+      await postOrder(order, pendingOrder.current.key);
+      pendingOrder.current = null;
       
       // Generate WhatsApp message
       const displayOrder = {
@@ -121,7 +158,11 @@ const CheckoutPage = () => {
       
     } catch (error) {
       console.error('Failed to create order:', error);
-      toast.error('Failed to create order. Please try again.');
+      toast.error(error.response?.status === 429
+        ? t('tooManyOrders')
+        : 'Failed to create order. Please try again.');
+    } finally {
+      setSubmitting(false);
     }
   };
 
@@ -295,6 +336,7 @@ const CheckoutPage = () => {
             <Button
               type="submit"
               data-testid="send-whatsapp-button"
+              disabled={submitting}
               className="w-full bg-[#25D366] hover:bg-[#25D366]/90 text-white h-12 rounded-full font-semibold text-lg active:scale-95 transition-transform"
             >
               {t('sendWhatsApp')}
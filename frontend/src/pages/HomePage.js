@@ -4,10 +4,7 @@ import { useLanguage } from '@/contexts/LanguageContext';
 import { Button } from '@/components/ui/button';
 import { motion } from 'framer-motion';
 import { ChevronRight } from 'lucide-react';
-import axios from 'axios';
-
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
-const API = `${BACKEND_URL}/api`;
+import { fetchCatalog } from '@/lib/catalog';
 
 const HomePage = () => {
   const { t, language } = useLanguage();
@@ -20,9 +17,8 @@ const HomePage = () => {
 
   const fetchCategories = async () => {
   try {
-    const response = await axios.get(`${API}/categories`);
-    const data = response.data;
-    setCategories(Array.isArray(data) ? data : (data.categories ?? []));
+    const catalog = await fetchCatalog();
+    setCategories(catalog.categories ?? []);
   } catch (error) {
     console.error('Failed to fetch categories:', error);
     setCategories([]);
@@ -74,7 +70,7 @@ const HomePage = () => {
                 .toLowerCase()
                 .replace(/\s+/g, '-')}`}
 
-                onClick={() => navigate(`/catalog?category=${encodeURIComponent(category.name_pt)}`)}
+                onClick={() => navigate(`/catalog?category_id=${encodeURIComponent(category.id)}`)}
                 className="bg-card rounded-xl shadow-md overflow-hidden cursor-pointer active:scale-95 transition-transform hover:shadow-lg"
               >
                 <div className="aspect-video overflow-hidden">
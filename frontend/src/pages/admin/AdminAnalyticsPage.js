@@ -27,16 +27,16 @@ const AdminAnalyticsPage = () => {
   const fetchAnalytics = async () => {
     try {
       setLoading(true);
-      const [summaryRes, productsRes] = await Promise.all([
-        axios.get(`${API}/analytics/summary`, {
-          headers: { Authorization: `Bearer ${token}` },
-        }),
-        axios.get(`${API}/analytics/products`, {
-          headers: { Authorization: `Bearer ${token}` },
-        }),
-      ]);
-      setSummary(summaryRes.data);
-      setProductAnalytics(productsRes.data);
+      // Both sections in one request, loaded concurrently by the backend
+      const { data } = await axios.get(`${API}/admin/dashboard`, {
+        params: { sections: 'summary,product_analytics' },
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setSummary(data.summary);
+      setProductAnalytics(data.product_analytics ?? []);
+      if (Object.keys(data.errors).length > 0) {
+        toast.error(t('admin.failedToLoadAnalytics'));
+      }
     } catch (error) {
       console.error('Failed to fetch analytics:', error);
       toast.error(t('admin.failedToLoadAnalytics'));
@@ -220,6 +220,9 @@ const AdminAnalyticsPage = () => {
                           <Eye className="h-4 w-4 text-muted-foreground" />
                           <span>{product.views}</span>
                         </div>
+                        <div className="text-xs text-muted-foreground mt-1">
+                          {product.unique_viewers ?? 0} {t('admin.uniqueViewers')}
+                        </div>
                       </td>
                       <td className="p-4">
                         <div className="flex items-center gap-1">
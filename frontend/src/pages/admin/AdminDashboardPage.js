@@ -19,6 +19,7 @@ const AdminDashboardPage = () => {
   const { token, logout } = useAuth();
   const navigate = useNavigate();
   const [products, setProducts] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [loading, setLoading] = useState(true);
   const [searchQuery, setSearchQuery] = useState('');
   const [filterCategory, setFilterCategory] = useState('');
@@ -30,11 +31,16 @@ const AdminDashboardPage = () => {
   const fetchProducts = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/products`, {
-        params: { active_only: false },
+      // All products plus the order summary in one request
+      const { data } = await axios.get(`${API}/admin/dashboard`, {
+        params: { sections: 'products,summary' },
         headers: { Authorization: `Bearer ${token}` },
       });
-      setProducts(response.data);
+      setProducts(data.products ?? []);
+      setSummary(data.summary);
+      if (Object.keys(data.errors).length > 0) {
+        toast.error(t('admin.error'));
+      }
     } catch (error) {
       console.error('Failed to fetch products:', error);
       toast.error(t('admin.error'));
@@ -150,6 +156,29 @@ const AdminDashboardPage = () => {
       </div>
 
       <div className="max-w-7xl mx-auto p-4">
+        {/* Order Summary */}
+        {summary && (
+          <button
+            type="button"
+            data-testid="admin-order-summary"
+            onClick={() => navigate('/admin/orders')}
+            className="mb-6 w-full grid grid-cols-3 gap-4 bg-card rounded-lg border border-muted p-4 text-left hover:border-primary transition-colors"
+          >
+            <div>
+              <div className="text-sm font-semibold text-muted-foreground">{t('admin.pending')}</div>
+              <div className="text-2xl font-bold">{summary.pending_orders}</div>
+            </div>
+            <div>
+              <div className="text-sm font-semibold text-muted-foreground">{t('admin.recentOrders')}</div>
+              <div className="text-2xl font-bold">{summary.recent_orders}</div>
+            </div>
+            <div>
+              <div className="text-sm font-semibold text-muted-foreground">{t('admin.totalRevenue')}</div>
+              <div className="text-2xl font-bold">{formatCurrency(summary.total_revenue)}</div>
+            </div>
+          </button>
+        )}
+
         {/* Actions Bar */}
         <div className="mb-6 flex flex-col sm:flex-row gap-4">
           <div className="flex-1 relative">
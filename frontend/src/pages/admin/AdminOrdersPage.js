@@ -5,7 +5,7 @@ import { useAuth } from '@/contexts/AuthContext';
 import { Button } from '@/components/ui/button';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { motion } from 'framer-motion';
-import { ArrowLeft, Clock, CheckCircle, XCircle, Package } from 'lucide-react';
+import { ArrowLeft, Clock, CheckCircle, XCircle, Package, Download } from 'lucide-react';
 import axios from 'axios';
 import { formatCurrency } from '@/lib/utils';
 import { toast } from 'sonner';
@@ -74,6 +74,25 @@ const AdminOrdersPage = () => {
     }
   };
 
+  const exportOrders = async () => {
+    try {
+      const params = filterStatus ? { status: filterStatus, format: 'csv' } : { format: 'csv' };
+      const response = await axios.get(`${API}/admin/export/orders`, {
+        params,
+        headers: { Authorization: `Bearer ${token}` },
+        responseType: 'blob',
+      });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `orders-${new Date().toISOString().slice(0, 10)}.csv`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      toast.error(t('admin.failedToExport'));
+    }
+  };
+
   const getStatusIcon = (status) => {
     switch (status) {
       case 'pending':
@@ -152,6 +171,16 @@ const AdminOrdersPage = () => {
               <SelectItem value="cancelled">{t('admin.cancelled')}</SelectItem>
             </SelectContent>
           </Select>
+          <Button
+            data-testid="export-orders"
+            onClick={exportOrders}
+            variant="outline"
+            size="sm"
+            className="ml-auto"
+          >
+            <Download className="h-4 w-4 mr-2" />
+            {t('admin.exportCsv')}
+          </Button>
         </div>
 
         {/* Orders List */}
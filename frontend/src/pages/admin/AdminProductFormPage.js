@@ -34,7 +34,7 @@ const AdminProductFormPage = () => {
     desc_en: '',
     desc_es: '',
     type: 'product',
-    category: '',
+    category_id: '',
     price: '',
     currency: 'BRL',
     image_url: '',
@@ -53,8 +53,8 @@ const AdminProductFormPage = () => {
     try {
       const response = await axios.get(`${API}/categories`);
       setCategories(response.data);
-      if (response.data.length > 0 && !formData.category) {
-        setFormData(prev => ({ ...prev, category: response.data[0].name_pt }));
+      if (response.data.length > 0 && !formData.category_id) {
+        setFormData(prev => ({ ...prev, category_id: response.data[0].id }));
       }
     } catch (error) {
       console.error('Failed to fetch categories:', error);
@@ -215,15 +215,15 @@ const AdminProductFormPage = () => {
             <Label>{t('admin.category')}</Label>
             <Select
               data-testid="admin-category-select"
-              value={formData.category}
-              onValueChange={(value) => setFormData({ ...formData, category: value })}
+              value={formData.category_id}
+              onValueChange={(value) => setFormData({ ...formData, category_id: value })}
             >
               <SelectTrigger className="h-12">
                 <SelectValue />
               </SelectTrigger>
               <SelectContent>
                 {categories.map((cat) => (
-                  <SelectItem key={cat.id} value={cat.name_pt}>
+                  <SelectItem key={cat.id} value={cat.id}>
                     {getCategoryName(cat)}
                   </SelectItem>
                 ))}
@@ -0,0 +1,13 @@
+"""CSV and NDJSON exports stream in constant memory.
+
+Runs ``python backend_benchmark.py --check-export-memory`` with 8 KB chunks,
+so the seeded history only needs to be an eighth of the default one.
+"""
+import asyncio
+
+from backend_benchmark import check_export_memory, exports
+
+
+def test_exports_stream_in_constant_memory(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_BYTES", 8 * 1024)
+    assert asyncio.run(check_export_memory(products=20)) == []
@@ -0,0 +1,27 @@
+"""Database round trips per request stay within ``QUERY_BUDGETS``.
+
+Runs every benchmark case against a small and a large in-memory catalog, like
+``python backend_benchmark.py --check-budgets``.
+"""
+import asyncio
+
+import pytest
+
+from backend_benchmark import QUERY_BUDGETS, budget_violations, build_cases, measure_db_calls
+
+CASE_NAMES = [case[0] for case in build_cases(["x"], ["x"])]
+
+
+@pytest.fixture(scope="module")
+def db_calls():
+    return asyncio.run(measure_db_calls())
+
+
+def test_every_case_has_a_budget():
+    assert sorted(CASE_NAMES) == sorted(QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize("name", CASE_NAMES)
+def test_query_budget(db_calls, name):
+    small, large = db_calls[name]
+    assert budget_violations(name, small, large) == []